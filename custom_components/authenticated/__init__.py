@@ -3,3 +3,7 @@
 
 class AuthenticatedBaseException(Exception):
     """Base exception for Authenticated."""
+
+
+class ProviderUnavailableException(AuthenticatedBaseException):
+    """Geo provider is skipped while its circuit breaker is open."""
@@ -0,0 +1,141 @@
+"""Anomaly scores for logins, from travel speed and never seen networks."""
+
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+EARTH_RADIUS = 6371.0
+
+# Faster than an airliner between two logins of one user is impossible.
+MAX_SPEED = 900.0
+# Geo data of IP addresses is rarely more precise than this.
+MIN_DISTANCE = 100.0
+# Logins closer together than this are treated as this far apart.
+MIN_INTERVAL = 60
+
+TRAVEL_WEIGHT = 0.5
+COUNTRY_WEIGHT = 0.3
+ASN_WEIGHT = 0.2
+
+
+def score_logins(logins):
+    """Return (score, speed) for each login, in the order given.
+
+    logins is a sequence of (user_id, timestamp, latitude, longitude,
+    country, asn). Each login is compared with the previous login of the
+    same user: the speed (km/h) needed to get from there in time, and
+    whether the country and ASN are new for the user. The score is
+    between 0 and 1, speed is None without coordinates for both logins.
+    """
+    if not logins:
+        return []
+    if np is None:
+        return _score_python(logins)
+    return _score_numpy(logins)
+
+
+def _codes(values):
+    """Return values as integer codes, -1 for None."""
+    codes = {}
+    return [
+        -1 if value is None else codes.setdefault(value, len(codes)) for value in values
+    ]
+
+
+def _score_numpy(logins):
+    """Score logins with array operations over all users at once."""
+    users, times, latitudes, longitudes, countries, asns = zip(*logins, strict=True)
+    users = np.array(_codes(users))
+    times = np.array(times, dtype=float)
+    order = np.lexsort((times, users))
+    users, times = users[order], times[order]
+    latitudes = np.radians(np.array(latitudes, dtype=float)[order])
+    longitudes = np.radians(np.array(longitudes, dtype=float)[order])
+
+    # Each login against the previous login of the same user.
+    same_user = np.zeros(len(users), dtype=bool)
+    same_user[1:] = users[1:] == users[:-1]
+    hours = np.maximum(np.diff(times, prepend=times[0]), MIN_INTERVAL) / 3600
+    half_lat = np.diff(latitudes, prepend=latitudes[0]) / 2
+    half_lon = np.diff(longitudes, prepend=longitudes[0]) / 2
+    haversine = (
+        np.sin(half_lat) ** 2
+        + np.cos(latitudes) * np.cos(np.roll(latitudes, 1)) * np.sin(half_lon) ** 2
+    )
+    distance = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(haversine, 0, 1)))
+    speed = np.where(distance < MIN_DISTANCE, 0.0, distance / hours)
+    speed[~same_user] = np.nan
+    travel = np.clip(np.nan_to_num(speed) / MAX_SPEED, 0, 1)
+
+    score = TRAVEL_WEIGHT * travel
+    for values, weight in ((countries, COUNTRY_WEIGHT), (asns, ASN_WEIGHT)):
+        codes = np.array(_codes(values))[order]
+        # The first login of a user with a value is where it is new.
+        pairs = users * (codes.max() + 2) + codes + 1
+        _, first = np.unique(pairs, return_index=True)
+        novel = np.zeros(len(users), dtype=bool)
+        novel[first] = True
+        score += weight * (novel & same_user & (codes >= 0))
+
+    scores = np.empty(len(logins))
+    speeds = np.empty(len(logins))
+    scores[order] = np.round(score, 2)
+    speeds[order] = np.round(speed)
+    return [
+        (value, None if math.isnan(kmh) else int(kmh))
+        for value, kmh in zip(scores.tolist(), speeds.tolist(), strict=True)
+    ]
+
+
+def _score_python(logins):
+    """Score logins one by one, when NumPy is not installed."""
+    order = sorted(
+        range(len(logins)),
+        key=lambda index: (str(logins[index][0]), logins[index][1]),
+    )
+    results = [None] * len(logins)
+    previous = None
+    seen = {}
+    for index in order:
+        user_id, when, latitude, longitude, country, asn = logins[index]
+        same_user = previous is not None and previous[0] == user_id
+        if not same_user:
+            seen = {"country": set(), "asn": set()}
+        speed = None
+        if (
+            same_user
+            and None not in (latitude, longitude)
+            and None not in (previous[2], previous[3])
+        ):
+            distance = _distance(previous[2], previous[3], latitude, longitude)
+            hours = max(when - previous[1], MIN_INTERVAL) / 3600
+            speed = 0.0 if distance < MIN_DISTANCE else distance / hours
+        score = TRAVEL_WEIGHT * min((speed or 0.0) / MAX_SPEED, 1.0)
+        for key, value, weight in (
+            ("country", country, COUNTRY_WEIGHT),
+            ("asn", asn, ASN_WEIGHT),
+        ):
+            if value is not None and value not in seen[key]:
+                if same_user:
+                    score += weight
+                seen[key].add(value)
+        results[index] = (round(score, 2), None if speed is None else round(speed))
+        previous = logins[index]
+    return results
+
+
+def _distance(latitude1, longitude1, latitude2, longitude2):
+    """Return the great circle distance between two points in km."""
+    latitude1, longitude1, latitude2, longitude2 = map(
+        math.radians, (latitude1, longitude1, latitude2, longitude2)
+    )
+    haversine = (
+        math.sin((latitude2 - latitude1) / 2) ** 2
+        + math.cos(latitude1)
+        * math.cos(latitude2)
+        * math.sin((longitude2 - longitude1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(min(haversine, 1.0)))
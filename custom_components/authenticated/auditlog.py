@@ -0,0 +1,159 @@
+"""Append-only JSON lines log of detected logins."""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import UTC, datetime
+
+from homeassistant.const import EVENT_HOMEASSISTANT_FINAL_WRITE
+from homeassistant.core import callback
+from homeassistant.helpers.event import async_call_later
+
+_LOGGER = logging.getLogger(__name__)
+
+FLUSH_DELAY = 5
+FLUSH_SIZE = 500
+MAX_PENDING = 10000
+
+FIELDS = (
+    "user_id",
+    "username",
+    "last_used_at",
+    "prev_used_at",
+    "hostname",
+    "country",
+    "region",
+    "city",
+    "asn",
+    "org",
+    "latitude",
+    "longitude",
+    "score",
+    "travel_speed",
+)
+
+
+class LoginLog:
+    """Write logins to a JSON lines file in the background.
+
+    Logins are buffered in memory and appended by the executor at most
+    FLUSH_DELAY seconds later, or as soon as FLUSH_SIZE are waiting. The
+    file is rotated to path.1 ... path.<backups> when it grows beyond
+    max_bytes or, if max_age is set, when it is older than that.
+    """
+
+    def __init__(self, hass, path, max_bytes, backups, max_age=None):
+        """Initialize."""
+        self.hass = hass
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.max_age = max_age
+        self.pending = []
+        self.unsub_flush = None
+        self.lock = asyncio.Lock()
+        self.unsub_final_write = hass.bus.async_listen_once(
+            EVENT_HOMEASSISTANT_FINAL_WRITE, self.async_final_write
+        )
+
+    @callback
+    def async_log(self, ipaddress, user_id=None, new_ip=None):
+        """Queue a login from an IP address.
+
+        user_id is the user that logged in, when it may differ from the
+        first user of the address. new_ip overrides the flag of the record.
+        """
+        if len(self.pending) >= MAX_PENDING:
+            _LOGGER.warning("Login log is not keeping up, dropping the oldest entry")
+            del self.pending[0]
+        entry = {
+            "time": datetime.now(UTC).isoformat(timespec="seconds"),
+            "ip_address": ipaddress.ip_address,
+            "new_ip": ipaddress.new_ip if new_ip is None else new_ip,
+            **{field: getattr(ipaddress, field) for field in FIELDS},
+        }
+        if user_id is not None:
+            entry["user_id"] = user_id
+        self.pending.append(entry)
+        if len(self.pending) >= FLUSH_SIZE:
+            self.hass.async_create_task(self.async_flush())
+        elif self.unsub_flush is None:
+            self.unsub_flush = async_call_later(
+                self.hass, FLUSH_DELAY, self.async_delayed_flush
+            )
+
+    @callback
+    def async_delayed_flush(self, _now):
+        """Write queued logins once the delay has passed."""
+        self.unsub_flush = None
+        self.hass.async_create_task(self.async_flush())
+
+    async def async_flush(self):
+        """Write queued logins now."""
+        if self.unsub_flush is not None:
+            self.unsub_flush()
+            self.unsub_flush = None
+        async with self.lock:
+            entries, self.pending = self.pending, []
+            if not entries:
+                return
+            try:
+                await self.hass.async_add_executor_job(self.write, entries)
+            except OSError as exception:
+                _LOGGER.error("Unable to write to %s: %s", self.path, exception)
+                self.pending = entries + self.pending
+
+    def write(self, entries):
+        """Append entries to the log file, rotating it first when needed."""
+        content = "".join(
+            json.dumps(entry, separators=(",", ":")) + "\n" for entry in entries
+        )
+        if self.should_rotate(len(content.encode())):
+            self.rotate()
+        with open(self.path, "a") as log_file:
+            log_file.write(content)
+
+    def should_rotate(self, size):
+        """Return True if adding size bytes calls for a new file."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        if stat.st_size and stat.st_size + size > self.max_bytes:
+            return True
+        # There is no creation time on Linux, the first line tells the age.
+        return bool(self.max_age) and self.started(stat) < time.time() - self.max_age
+
+    def started(self, stat):
+        """Return when the current file was started, as epoch seconds."""
+        try:
+            with open(self.path) as log_file:
+                first = json.loads(log_file.readline())
+            return datetime.fromisoformat(first["time"]).timestamp()
+        except (OSError, ValueError, KeyError, TypeError):
+            return stat.st_mtime
+
+    def rotate(self):
+        """Shift path.N to path.N+1 and start a new file."""
+        if self.backups <= 0:
+            os.remove(self.path)
+            return
+        for number in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{number}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{number + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    async def async_final_write(self, _event):
+        """Write queued logins on shutdown."""
+        self.unsub_final_write = None
+        await self.async_flush()
+
+    async def async_close(self):
+        """Write queued logins and stop listening for shutdown."""
+        if self.unsub_final_write is not None:
+            self.unsub_final_write()
+            self.unsub_final_write = None
+        await self.async_flush()
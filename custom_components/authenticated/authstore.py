@@ -0,0 +1,116 @@
+"""Streaming reader for the Home Assistant auth store."""
+
+import json
+import re
+
+CHUNK_SIZE = 64 * 1024
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+class JsonStream:
+    """Walk a JSON document read from a file in chunks.
+
+    Objects and arrays can be entered one member at a time, so only the
+    value being decoded and the current chunk are held in memory.
+    """
+
+    def __init__(self, file):
+        """Initialize."""
+        self.file = file
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def read(self, size=CHUNK_SIZE):
+        """Append more of the file to the buffer, return False at the end."""
+        if self.eof:
+            return False
+        chunk = self.file.read(size)
+        if not chunk:
+            self.eof = True
+            return False
+        if self.pos:
+            # Drop what has been consumed already.
+            self.buffer = self.buffer[self.pos :]
+            self.pos = 0
+        self.buffer += chunk
+        return True
+
+    def peek(self):
+        """Return the next character that is not whitespace."""
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.read():
+                raise ValueError("Unexpected end of JSON data")
+
+    def expect(self, characters):
+        """Consume one of the given structural characters and return it."""
+        character = self.peek()
+        if character not in characters:
+            raise ValueError(f"Expected one of {characters!r}, got {character!r}")
+        self.pos += 1
+        return character
+
+    def value(self):
+        """Decode the next value."""
+        self.peek()
+        size = CHUNK_SIZE
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self.read(size):
+                    raise
+            else:
+                # A number at the end of the buffer may continue in the file.
+                if end < len(self.buffer) or not self.read(size):
+                    self.pos = end
+                    return value
+            size *= 2
+
+    def members(self):
+        """Yield the keys of an object, the caller consumes each value."""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.expect(",}") == "}":
+                return
+
+    def elements(self):
+        """Yield the elements of an array."""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(",]") == "]":
+                return
+
+
+def iter_auth_store(path, sections=("users", "refresh_tokens")):
+    """Yield (section, item) for the items of the given lists in the store.
+
+    Everything else in the store is decoded and dropped value by value.
+    """
+    with open(path) as file:
+        stream = JsonStream(file)
+        for key in stream.members():
+            if key != "data":
+                stream.value()
+                continue
+            for section in stream.members():
+                if section not in sections:
+                    stream.value()
+                    continue
+                for item in stream.elements():
+                    yield section, item
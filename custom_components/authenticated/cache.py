@@ -0,0 +1,129 @@
+"""Persistent cache for geo lookups."""
+
+import logging
+import time
+from collections import OrderedDict
+from ipaddress import ip_address as parse_ip
+
+from homeassistant.helpers.storage import Store
+
+from .const import DOMAIN
+from .metrics import METRICS
+
+_LOGGER = logging.getLogger(__name__)
+
+STORAGE_KEY = f"{DOMAIN}.geo_cache"
+STORAGE_VERSION = 1
+SAVE_DELAY = 30
+
+NEGATIVE_TTL = 60 * 60
+PREFIX_CACHE_SIZE = 4096
+
+
+class GeoCache:
+    """LRU cache of geo lookups keyed by provider and IP address.
+
+    Failed lookups are cached as well, with a shorter time to live, so
+    errors and rate limits are not retried on every update.
+    """
+
+    def __init__(self, hass, ttl, max_size):
+        """Initialize."""
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.store = Store(hass, STORAGE_VERSION, STORAGE_KEY)
+
+    async def async_load(self):
+        """Load the cache from disk."""
+        data = await self.store.async_load()
+        if not data:
+            return
+        now = time.time()
+        for key, entry in data.get("entries", []):
+            if entry["expires"] > now:
+                self.entries[key] = entry
+        self.evict()
+        _LOGGER.debug("Loaded %s cached geo lookups", len(self.entries))
+
+    def get(self, provider, ip_address):
+        """Return (hit, data) for an IP address, data is None for failures."""
+        key = f"{provider}|{ip_address}"
+        entry = self.entries.get(key)
+        if entry is None:
+            METRICS.count("geo_cache_miss")
+            return False, None
+        if entry["expires"] <= time.time():
+            del self.entries[key]
+            METRICS.count("geo_cache_miss")
+            return False, None
+        self.entries.move_to_end(key)
+        METRICS.count("geo_cache_hit")
+        return True, entry["data"]
+
+    def set(self, provider, ip_address, data):
+        """Cache the result of a lookup, use None for a failed lookup."""
+        if self.max_size <= 0:
+            return
+        ttl = self.ttl if data is not None else NEGATIVE_TTL
+        key = f"{provider}|{ip_address}"
+        self.entries[key] = {"data": data, "expires": time.time() + ttl}
+        self.entries.move_to_end(key)
+        self.evict()
+        self.store.async_delay_save(self.data_to_save, SAVE_DELAY)
+
+    def evict(self):
+        """Drop the least recently used entries above the size limit."""
+        while len(self.entries) > max(self.max_size, 0):
+            self.entries.popitem(last=False)
+
+    def data_to_save(self):
+        """Return the data to store, in LRU order."""
+        return {"entries": list(self.entries.items())}
+
+
+class PrefixCache:
+    """Geo data shared between addresses in the same network prefix.
+
+    Addresses of mobile and residential clients change within the blocks
+    of their provider, so a recent result for a neighbour in the same /24
+    (IPv4) or /48 (IPv6) is a good answer for a new address.
+    """
+
+    def __init__(self, ipv4_prefix, ipv6_prefix, ttl):
+        """Initialize."""
+        self.shifts = {4: 32 - ipv4_prefix, 6: 128 - ipv6_prefix}
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def key(self, ip_address):
+        """Return the prefix of an address."""
+        address = parse_ip(ip_address)
+        return address.version, int(address) >> self.shifts[address.version]
+
+    def get(self, ip_address):
+        """Return geo data of a neighbour, or None."""
+        key = self.key(ip_address)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        data, expires = entry
+        if expires <= time.time():
+            del self.entries[key]
+            return None
+        return data
+
+    def set(self, ip_address, data, resolved_at=None):
+        """Share the geo data of an address with its prefix."""
+        if resolved_at is None:
+            resolved_at = time.time()
+        expires = resolved_at + self.ttl
+        if not data or expires <= time.time():
+            return
+        key = self.key(ip_address)
+        if key in self.entries and self.entries[key][1] >= expires:
+            return
+        self.entries[key] = (data, expires)
+        self.entries.move_to_end(key)
+        while len(self.entries) > PREFIX_CACHE_SIZE:
+            self.entries.popitem(last=False)
@@ -18,9 +18,36 @@ https://github.com/rarosalion/authenticated/issues
 CONF_NOTIFY = "enable_notification"
 CONF_NOTIFY_ECLUDE_ASN = "notify_exclude_asns"
 CONF_NOTIFY_ECLUDE_HOSTNAMES = "notify_exclude_hostnames"
+CONF_NOTIFY_WINDOW = "notify_window"
+CONF_NOTIFY_MAX_PER_HOUR = "notify_max_per_hour"
+CONF_NOTIFY_MIN_SCORE = "notify_min_score"
 CONF_EXCLUDE = "exclude"
 CONF_EXCLUDE_CLIENTS = "exclude_clients"
 CONF_PROVIDER = "provider"
 CONF_LOG_LOCATION = "log_location"
+CONF_LOG_MAX_SIZE = "log_max_size"
+CONF_LOG_BACKUPS = "log_backups"
+CONF_LOG_MAX_DAYS = "log_max_days"
+CONF_WATCH = "watch_auth_file"
+CONF_GEO_CACHE_DAYS = "geo_cache_days"
+CONF_GEO_CACHE_SIZE = "geo_cache_size"
+CONF_GEO_PREFIX_SHARING = "geo_prefix_sharing"
+CONF_GEO_PREFIX_IPV4 = "geo_prefix_ipv4"
+CONF_GEO_PREFIX_IPV6 = "geo_prefix_ipv6"
+CONF_GEO_PREFIX_HOURS = "geo_prefix_hours"
+CONF_GEO_PREFIX_VERIFY = "geo_prefix_verify"
+CONF_LOCAL_DATABASE = "local_database"
+CONF_DNS_TIMEOUT = "dns_timeout"
+CONF_STORAGE = "storage"
+CONF_SAVE_DELAY = "save_delay"
+CONF_MAX_AGE_DAYS = "max_age_days"
+CONF_MAX_ENTRIES = "max_entries"
+CONF_HISTORY_SIZE = "history_size"
+CONF_METRICS = "metrics"
+CONF_HEDGE_DELAY = "hedge_delay"
+CONF_USER_SENSORS = "user_sensors"
+
+SERVICE_QUERY_LOGINS = "query_logins"
 
 OUTFILE = ".ip_authenticated.yaml"
+OUTFILE_DB = ".ip_authenticated.db"
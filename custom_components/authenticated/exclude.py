@@ -0,0 +1,62 @@
+"""Exclusion of refresh tokens by network and client."""
+
+import logging
+from bisect import bisect_right
+from ipaddress import ip_address, ip_network
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class ExclusionMatcher:
+    """Excluded networks and client IDs, compiled once at setup.
+
+    Networks are merged into sorted, non-overlapping integer intervals per
+    address family, so checking an address is a single binary search.
+    """
+
+    def __init__(self, networks, clients):
+        """Initialize."""
+        self.clients = frozenset(clients)
+        intervals = {4: [], 6: []}
+        for value in networks:
+            try:
+                network = ip_network(value, False)
+            except ValueError:
+                _LOGGER.error("Invalid network in exclude configuration: %s", value)
+                continue
+            intervals[network.version].append(
+                (int(network.network_address), int(network.broadcast_address))
+            )
+
+        self.starts = {}
+        self.ends = {}
+        for version, ranges in intervals.items():
+            starts, ends = [], []
+            for start, end in sorted(ranges):
+                if ends and start <= ends[-1] + 1:
+                    ends[-1] = max(ends[-1], end)
+                else:
+                    starts.append(start)
+                    ends.append(end)
+            self.starts[version] = starts
+            self.ends[version] = ends
+
+    def excluded_ip(self, address):
+        """Return True if the address is in an excluded network."""
+        try:
+            address = ip_address(address)
+        except ValueError:
+            return False
+        starts = self.starts[address.version]
+        index = bisect_right(starts, int(address)) - 1
+        return index >= 0 and int(address) <= self.ends[address.version][index]
+
+    def excluded_client(self, client_id):
+        """Return True if the client is excluded."""
+        return client_id in self.clients
+
+    def excluded(self, token):
+        """Return True if a refresh token should be ignored."""
+        return self.excluded_client(token.get("client_id")) or self.excluded_ip(
+            token.get("last_used_ip")
+        )
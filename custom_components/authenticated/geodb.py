@@ -0,0 +1,211 @@
+"""Local IP range database for offline geo lookups."""
+
+import csv
+import heapq
+import logging
+import mmap
+import threading
+from array import array
+from bisect import bisect_right
+from ipaddress import ip_address, ip_network
+
+_LOGGER = logging.getLogger(__name__)
+
+FIELDS = ("country", "region", "city", "asn", "org", "latitude", "longitude")
+
+
+class PackedKeys:
+    """Sequence view over fixed width big-endian integers packed in bytes."""
+
+    def __init__(self, data, width):
+        """Initialize."""
+        self.data = data
+        self.width = width
+
+    def __len__(self):
+        """Return the number of keys."""
+        return len(self.data) // self.width
+
+    def __getitem__(self, index):
+        """Return the key at index, comparable as bytes."""
+        start = index * self.width
+        return self.data[start : start + self.width]
+
+
+def flatten_ranges(ranges):
+    """Return ranges sorted and without overlaps, the smallest range wins.
+
+    Nested blocks, such as a /16 inside a /8, are split so that every
+    address belongs to the most specific range containing it.
+    """
+    ranges = sorted(ranges)
+    if all(ranges[i][0] > ranges[i - 1][1] for i in range(1, len(ranges))):
+        return ranges
+
+    boundaries = sorted(
+        {start for start, _, _ in ranges} | {end + 1 for _, end, _ in ranges}
+    )
+    flat = []
+    active = []
+    index = 0
+    for position, following in zip(boundaries, boundaries[1:], strict=False):
+        while index < len(ranges) and ranges[index][0] == position:
+            start, end, offset = ranges[index]
+            heapq.heappush(active, (end - start, end, offset))
+            index += 1
+        while active and active[0][1] < position:
+            heapq.heappop(active)
+        if not active:
+            continue
+        offset = active[0][2]
+        if flat and flat[-1][2] == offset and flat[-1][1] == position - 1:
+            flat[-1] = (flat[-1][0], following - 1, offset)
+        else:
+            flat.append((position, following - 1, offset))
+    return flat
+
+
+class RangeIndex:
+    """Sorted IP ranges of one address family, searched with bisect."""
+
+    def __init__(self, width, ranges):
+        """Initialize from sorted (start, end, offset) tuples without overlaps."""
+        self.width = width
+        self.starts = PackedKeys(
+            b"".join(start.to_bytes(width, "big") for start, _, _ in ranges), width
+        )
+        self.ends = PackedKeys(
+            b"".join(end.to_bytes(width, "big") for _, end, _ in ranges), width
+        )
+        self.offsets = array("Q", (offset for _, _, offset in ranges))
+
+    def find(self, address):
+        """Return the file offset of the range containing address, or None."""
+        key = address.to_bytes(self.width, "big")
+        index = bisect_right(self.starts, key) - 1
+        if index < 0 or self.ends[index] < key:
+            return None
+        return self.offsets[index]
+
+
+class RangeDatabase:
+    """CSV file of IP ranges, loaded lazily and memory mapped.
+
+    The first row names the columns. Ranges are given either as a
+    ``network`` column in CIDR notation or as ``start`` and ``end``
+    addresses, the other recognised columns are country, region, city,
+    asn, org, latitude and longitude. Ranges may be nested, an address
+    gets the record of the most specific range. Only the range boundaries
+    and line offsets are kept in memory, the records themselves are read
+    from the mapped file.
+    """
+
+    def __init__(self, path):
+        """Initialize."""
+        self.path = path
+        self.columns = None
+        self.indexes = {}
+        self.file = None
+        self.map = None
+        self.lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        """Return True when the index has been built."""
+        return bool(self.indexes)
+
+    def load(self):
+        """Map the file and build the range index."""
+        with self.lock:
+            if self.loaded:
+                return
+            self.file = open(self.path, "rb")  # noqa: SIM115
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.build()
+
+    def build(self):
+        """Build the range index from the mapped file."""
+        ranges = {4: [], 6: []}
+        offset = 0
+        line = self.map.readline()
+        self.columns = {
+            name.strip().lower(): column
+            for column, name in enumerate(self.parse_line(line))
+        }
+        offset += len(line)
+
+        while line := self.map.readline():
+            try:
+                start, end = self.parse_range(self.parse_line(line))
+            except (KeyError, IndexError, ValueError):
+                _LOGGER.debug("Skipping invalid line in %s: %s", self.path, line)
+            else:
+                if start.version == end.version:
+                    ranges[start.version].append((int(start), int(end), offset))
+            offset += len(line)
+
+        loaded = {version: len(ranges[version]) for version in ranges}
+        for version in ranges:
+            ranges[version] = flatten_ranges(ranges[version])
+            if len(ranges[version]) != loaded[version]:
+                _LOGGER.debug(
+                    "Flattened overlapping IPv%s ranges in %s, %s ranges from %s",
+                    version,
+                    self.path,
+                    len(ranges[version]),
+                    loaded[version],
+                )
+        self.indexes = {
+            version: RangeIndex(4 if version == 4 else 16, ranges[version])
+            for version in ranges
+        }
+        _LOGGER.debug(
+            "Loaded %s IPv4 and %s IPv6 ranges from %s",
+            loaded[4],
+            loaded[6],
+            self.path,
+        )
+
+    @staticmethod
+    def parse_line(line):
+        """Split a single CSV line."""
+        return next(csv.reader([line.decode("utf-8").strip()]))
+
+    def parse_range(self, row):
+        """Return the first and last address of the range in a row."""
+        if "network" in self.columns:
+            network = ip_network(row[self.columns["network"]], False)
+            return network[0], network[-1]
+        return (
+            ip_address(row[self.columns["start"]]),
+            ip_address(row[self.columns["end"]]),
+        )
+
+    def lookup(self, address):
+        """Return the record for an IP address, or None."""
+        address = ip_address(address)
+        index = self.indexes.get(address.version)
+        if index is None:
+            return None
+        offset = index.find(int(address))
+        if offset is None:
+            return None
+
+        end = self.map.find(b"\n", offset)
+        row = self.parse_line(self.map[offset : end if end >= 0 else len(self.map)])
+        return {
+            field: row[self.columns[field]] or None
+            for field in FIELDS
+            if field in self.columns and self.columns[field] < len(row)
+        }
+
+    def close(self):
+        """Unmap and close the file."""
+        with self.lock:
+            self.indexes = {}
+            if self.map is not None:
+                self.map.close()
+                self.map = None
+            if self.file is not None:
+                self.file.close()
+                self.file = None
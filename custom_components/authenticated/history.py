@@ -0,0 +1,69 @@
+"""Login history per IP address."""
+
+import sys
+from array import array
+from bisect import bisect_left
+
+HISTORY_SIZE = 20
+
+
+class LoginHistory:
+    """Most recent logins from one IP address, oldest first.
+
+    Login times are kept as epoch seconds in an array, so counting the
+    logins in a time window is a binary search.
+    """
+
+    __slots__ = ("times", "user_ids")
+
+    maxlen = HISTORY_SIZE
+
+    def __init__(self, entries=()):
+        """Initialize from (timestamp, user_id) pairs."""
+        self.times = array("q")
+        self.user_ids = []
+        for when, user_id in sorted(entries or (), key=lambda entry: entry[0]):
+            self.add(when, user_id)
+
+    def __len__(self):
+        """Return the number of logins kept."""
+        return len(self.times)
+
+    def add(self, when, user_id):
+        """Add a login, return False if it is already known."""
+        when = int(when)
+        if self.times and when <= self.times[-1]:
+            if when in self.times:
+                return False
+            index = bisect_left(self.times, when)
+        else:
+            index = len(self.times)
+        self.times.insert(index, when)
+        self.user_ids.insert(index, sys.intern(user_id) if user_id else None)
+        while len(self.times) > self.maxlen:
+            del self.times[0]
+            del self.user_ids[0]
+        return True
+
+    def count_since(self, since, user_ids=None):
+        """Return the number of logins at or after since.
+
+        With user_ids, only logins by one of those users are counted.
+        """
+        index = bisect_left(self.times, int(since))
+        if user_ids is None:
+            return len(self.times) - index
+        return sum(1 for entry in self.user_ids[index:] if entry in user_ids)
+
+    def frequency(self, window, now, user_ids=None):
+        """Return logins per hour over the window (seconds) ending at now."""
+        if window <= 0:
+            return 0.0
+        return self.count_since(now - window, user_ids) * 3600 / window
+
+    def as_list(self):
+        """Return the history as [timestamp, user_id] pairs."""
+        return [
+            [when, user_id]
+            for when, user_id in zip(self.times, self.user_ids, strict=True)
+        ]
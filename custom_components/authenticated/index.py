@@ -0,0 +1,120 @@
+"""In-memory indexes over known IP addresses."""
+
+from bisect import bisect_left, bisect_right, insort
+
+
+class LoginIndex:
+    """Known IP addresses by user, ASN, country and time of last login.
+
+    Records are added again whenever they change, so the indexes are kept
+    up to date without scanning all addresses.
+    """
+
+    def __init__(self):
+        """Initialize."""
+        self.entries = {}
+        self.by_user = {}
+        self.by_asn = {}
+        self.by_country = {}
+        self.by_time = []
+
+    def __len__(self):
+        """Return the number of indexed addresses."""
+        return len(self.entries)
+
+    @staticmethod
+    def keys(ipaddress):
+        """Return the index keys of an IP record."""
+        users = {ipaddress.user_id, *ipaddress.history.user_ids}
+        users.discard(None)
+        return (
+            frozenset(users),
+            ipaddress.asn,
+            ipaddress.country,
+            ipaddress.last_used_ts,
+        )
+
+    def update(self, ipaddress):
+        """Add or refresh an IP record."""
+        keys = self.keys(ipaddress)
+        ipaddr = ipaddress.ip_address
+        if self.entries.get(ipaddr) == keys:
+            return
+        self.remove(ipaddr)
+        users, asn, country, when = keys
+        self.entries[ipaddr] = keys
+        for user_id in users:
+            self.by_user.setdefault(user_id, set()).add(ipaddr)
+        if asn is not None:
+            self.by_asn.setdefault(asn, set()).add(ipaddr)
+        if country is not None:
+            self.by_country.setdefault(country, set()).add(ipaddr)
+        insort(self.by_time, (when, ipaddr))
+
+    def remove(self, ipaddr):
+        """Remove an IP address."""
+        keys = self.entries.pop(ipaddr, None)
+        if keys is None:
+            return
+        users, asn, country, when = keys
+        for user_id in users:
+            self.discard(self.by_user, user_id, ipaddr)
+        self.discard(self.by_asn, asn, ipaddr)
+        self.discard(self.by_country, country, ipaddr)
+        index = bisect_left(self.by_time, (when, ipaddr))
+        if index < len(self.by_time) and self.by_time[index] == (when, ipaddr):
+            del self.by_time[index]
+
+    @staticmethod
+    def discard(index, key, ipaddr):
+        """Remove an address from one index entry."""
+        addresses = index.get(key)
+        if addresses is None:
+            return
+        addresses.discard(ipaddr)
+        if not addresses:
+            del index[key]
+
+    def query(self, user_ids=None, asn=None, country=None, since=None, until=None):
+        """Return matching IP addresses, most recently used first.
+
+        user_ids is a collection of user IDs, any of them matches. Times
+        are epoch seconds and both ends are inclusive.
+        """
+        selections = []
+        if user_ids is not None:
+            selections.append(
+                set().union(*(self.by_user.get(user_id, ()) for user_id in user_ids))
+            )
+        if asn is not None:
+            selections.append(self.by_asn.get(asn, set()))
+        if country is not None:
+            selections.append(self.by_country.get(country, set()))
+
+        start = 0 if since is None else bisect_left(self.by_time, (since,))
+        end = (
+            len(self.by_time)
+            if until is None
+            else bisect_right(self.by_time, (until, chr(0x10FFFF)))
+        )
+        if not selections:
+            return [ipaddr for _, ipaddr in reversed(self.by_time[start:end])]
+
+        selections.sort(key=len)
+        matches = set(selections[0]).intersection(*selections[1:])
+        if end - start > len(matches):
+            return sorted(
+                (
+                    ipaddr
+                    for ipaddr in matches
+                    if (since is None or self.entries[ipaddr][3] >= since)
+                    and (until is None or self.entries[ipaddr][3] <= until)
+                ),
+                key=lambda ipaddr: (self.entries[ipaddr][3], ipaddr),
+                reverse=True,
+            )
+        return [
+            ipaddr
+            for _, ipaddr in reversed(self.by_time[start:end])
+            if ipaddr in matches
+        ]
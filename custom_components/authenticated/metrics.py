@@ -0,0 +1,135 @@
+"""Timings and counters for the slow parts of an update."""
+
+import logging
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import nullcontext
+
+_LOGGER = logging.getLogger(__name__)
+
+# Upper bounds of the latency histogram buckets, in milliseconds.
+BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# Counters that are reported as hit ratios, name: (hits, misses).
+RATIOS = {
+    "geo_cache": ("geo_cache_hit", "geo_cache_miss"),
+    "dns_cache": ("dns_cache_hit", "dns_cache_miss"),
+}
+
+NOT_TIMED = nullcontext()
+
+
+class Histogram:
+    """Latency histogram with fixed buckets."""
+
+    __slots__ = ("buckets", "count", "total", "max", "last")
+
+    def __init__(self):
+        """Initialize."""
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def add(self, value):
+        """Add a duration in milliseconds."""
+        self.buckets[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.last = value
+
+    def as_dict(self):
+        """Return the histogram as state attributes."""
+        bounds = [f"<={bound}ms" for bound in BUCKETS] + [f">{BUCKETS[-1]}ms"]
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count, 2) if self.count else None,
+            "max_ms": round(self.max, 2),
+            "last_ms": round(self.last, 2),
+            "histogram": {
+                bound: count
+                for bound, count in zip(bounds, self.buckets, strict=True)
+                if count
+            },
+        }
+
+
+class Timer:
+    """Context manager that adds its duration to a histogram."""
+
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics, name):
+        """Initialize."""
+        self.metrics = metrics
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        """Start timing."""
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        """Stop timing and record the duration."""
+        self.metrics.record(self.name, (time.perf_counter() - self.start) * 1000)
+
+
+class Metrics:
+    """Latency histograms and counters, kept only while enabled.
+
+    When disabled, timer() returns a shared no-op context manager and
+    count() returns at once, so the instrumented code pays one attribute
+    check per call.
+    """
+
+    def __init__(self):
+        """Initialize."""
+        self.enabled = False
+        self.timings = {}
+        self.counters = Counter()
+
+    def timer(self, name):
+        """Return a context manager timing the block it wraps."""
+        if not self.enabled:
+            return NOT_TIMED
+        return Timer(self, name)
+
+    def record(self, name, milliseconds):
+        """Add a duration to the histogram of name."""
+        histogram = self.timings.get(name)
+        if histogram is None:
+            histogram = self.timings[name] = Histogram()
+        histogram.add(milliseconds)
+        _LOGGER.debug("%s took %.1f ms", name, milliseconds)
+
+    def count(self, name, value=1):
+        """Increase a counter."""
+        if self.enabled:
+            self.counters[name] += value
+
+    def ratio(self, name):
+        """Return a hit ratio, None before anything was counted."""
+        hits, misses = (self.counters[counter] for counter in RATIOS[name])
+        if not hits + misses:
+            return None
+        return round(hits / (hits + misses), 3)
+
+    def reset(self):
+        """Forget all timings and counters."""
+        self.timings.clear()
+        self.counters.clear()
+
+    def as_dict(self):
+        """Return everything as state attributes."""
+        return {
+            **{name: histogram.as_dict() for name, histogram in self.timings.items()},
+            "counters": dict(self.counters),
+            **{f"{name}_hit_ratio": self.ratio(name) for name in RATIOS},
+        }
+
+
+METRICS = Metrics()
@@ -0,0 +1,98 @@
+"""Batched, rate limited login notifications."""
+
+import logging
+import time
+from collections import deque
+
+from homeassistant.components.persistent_notification import async_create
+from homeassistant.core import callback
+from homeassistant.helpers.event import async_call_later
+
+from .const import DOMAIN
+
+_LOGGER = logging.getLogger(__name__)
+
+DEDUPE_TTL = 60 * 60
+RATE_PERIOD = 60 * 60
+
+
+class NotificationQueue:
+    """Collect new login notifications and send them as digests.
+
+    Logins queued within window seconds of the first one are sent as one
+    notification. At most max_per_hour notifications are created, logins
+    beyond that wait for the next free slot and are added to its digest.
+    A login from the same IP address by the same user is only notified
+    once per DEDUPE_TTL.
+    """
+
+    def __init__(self, hass, window, max_per_hour):
+        """Initialize."""
+        self.hass = hass
+        self.window = window
+        self.max_per_hour = max_per_hour
+        self.pending = {}
+        self.sent = {}
+        self.send_times = deque()
+        self.unsub_flush = None
+
+    @callback
+    def async_enqueue(self, ipaddress):
+        """Queue a notification for a login from a new IP address."""
+        key = (ipaddress.ip_address, ipaddress.user_id)
+        now = time.monotonic()
+        if key in self.pending or (
+            key in self.sent and self.sent[key] > now - DEDUPE_TTL
+        ):
+            _LOGGER.debug("Skipping duplicate notification for %s", key)
+            return
+        self.pending[key] = ipaddress.notification_message()
+        self.async_schedule(self.window)
+
+    @callback
+    def async_schedule(self, delay):
+        """Send the pending notifications after delay seconds."""
+        if self.unsub_flush is None:
+            self.unsub_flush = async_call_later(self.hass, delay, self.async_flush)
+
+    @callback
+    def async_flush(self, _now=None):
+        """Send the pending notifications, if the rate limit allows it."""
+        self.unsub_flush = None
+        if not self.pending:
+            return
+        now = time.monotonic()
+        while self.send_times and self.send_times[0] <= now - RATE_PERIOD:
+            self.send_times.popleft()
+        if self.max_per_hour and len(self.send_times) >= self.max_per_hour:
+            self.async_schedule(self.send_times[0] + RATE_PERIOD - now)
+            return
+
+        pending, self.pending = self.pending, {}
+        if len(pending) == 1:
+            (ipaddr, _), message = next(iter(pending.items()))
+            async_create(
+                self.hass, message, title="New successful login", notification_id=ipaddr
+            )
+        else:
+            async_create(
+                self.hass,
+                "\n\n---\n".join(pending.values()),
+                title=f"{len(pending)} new successful logins",
+                notification_id=f"{DOMAIN}_{int(time.time())}",
+            )
+        self.send_times.append(now)
+        for key in pending:
+            self.sent[key] = now
+        self.sent = {
+            key: sent for key, sent in self.sent.items() if sent > now - DEDUPE_TTL
+        }
+
+    @callback
+    def async_close(self):
+        """Send what is pending and stop the timer."""
+        if self.unsub_flush is not None:
+            self.unsub_flush()
+            self.unsub_flush = None
+        self.max_per_hour = 0
+        self.async_flush()
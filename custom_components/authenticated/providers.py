@@ -1,14 +1,31 @@
 """Providers."""
 
+import asyncio
 import logging
+import random
+import time
+from email.utils import parsedate_to_datetime
 
-import requests
+import aiohttp
 
-from . import AuthenticatedBaseException
+from . import AuthenticatedBaseException, ProviderUnavailableException
+from .geodb import RangeDatabase
+from .metrics import METRICS
 
 _LOGGER = logging.getLogger(__name__)
 
+TIMEOUT = aiohttp.ClientTimeout(total=5)
+PARALLEL_LOOKUPS = 4
+
+RETRIES = 2
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+BACKOFF = 0.5
+MAX_RETRY_DELAY = 10
+FAILURE_THRESHOLD = 5
+COOL_DOWN = 5 * 60
+
 PROVIDERS = {}
+BREAKERS = {}
 
 
 def register_provider(classname):
@@ -17,10 +34,132 @@ def register_provider(classname):
     return classname
 
 
+async def async_lookup_hedged(session, ipaddrs, providers, delay=None):
+    """Look up IP addresses with the first provider, hedging with the second.
+
+    When the first provider has not answered within delay seconds, the
+    second one is asked as well, and the lookup ends as soon as every
+    address has a result. Return the results of each provider that
+    answered by provider name, in the order they arrived.
+    """
+    tasks = {
+        asyncio.ensure_future(
+            PROVIDERS[providers[0]].async_lookup_many(session, ipaddrs)
+        ): providers[0]
+    }
+    if delay is not None and len(providers) > 1:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            METRICS.count("provider_hedged")
+            tasks[
+                asyncio.ensure_future(
+                    PROVIDERS[providers[1]].async_lookup_many(session, ipaddrs)
+                )
+            ] = providers[1]
+
+    answers = {}
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                answers[tasks[task]] = task.result()
+            if all(
+                any(found.get(ipaddr) for found in answers.values())
+                for ipaddr in ipaddrs
+            ):
+                break
+    finally:
+        for task in pending:
+            task.cancel()
+    return answers
+
+
+def warn_insecure(providers):
+    """Log a warning for each provider that sends IP addresses unencrypted."""
+    for name in providers:
+        if not PROVIDERS[name].secure:
+            _LOGGER.warning(
+                "The %s provider is queried over plain HTTP, login IP addresses "
+                "are sent unencrypted",
+                name,
+            )
+
+
+def retry_after(value):
+    """Return the seconds to wait from a Retry-After header, or None."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def coordinate(value):
+    """Return a latitude or longitude as a float, or None."""
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """Stop sending requests to a provider that keeps failing.
+
+    The breaker opens after FAILURE_THRESHOLD failed requests in a row, or
+    when a rate limit asks to wait longer than MAX_RETRY_DELAY. Requests
+    are skipped until the cool-down has passed, then the next answer
+    decides whether it closes again or opens for another cool-down.
+    """
+
+    def __init__(self, name):
+        """Initialize."""
+        self.name = name
+        self.failures = 0
+        self.open_until = 0.0
+
+    def allow(self):
+        """Return True if a request may be sent."""
+        return time.monotonic() >= self.open_until
+
+    def success(self):
+        """Close the breaker after an answer from the provider."""
+        self.failures = 0
+        self.open_until = 0.0
+
+    def failure(self, cool_down=None):
+        """Count a failed request, open the breaker when needed."""
+        self.failures += 1
+        if cool_down is None:
+            if self.failures < FAILURE_THRESHOLD:
+                return
+            cool_down = COOL_DOWN
+        if self.allow():
+            _LOGGER.warning(
+                "Geo provider %s is failing, pausing lookups for %s seconds",
+                self.name,
+                round(cool_down),
+            )
+        self.open_until = max(self.open_until, time.monotonic() + cool_down)
+
+
 class GeoProvider:
     """GeoProvider class."""
 
     url = None
+    batch_url = None
+    batch_size = 100
+    cacheable = True
+    secure = True
 
     def __init__(self, ipaddr):
         """Initialize."""
@@ -52,50 +191,188 @@ class GeoProvider:
         """Return organisation name or None."""
         return self.result.get("org")
 
+    @property
+    def latitude(self):
+        """Return latitude or None."""
+        return coordinate(self.result.get("latitude"))
+
+    @property
+    def longitude(self):
+        """Return longitude or None."""
+        return coordinate(self.result.get("longitude"))
+
     @property
     def computed_result(self):
         """Return the computed result."""
-        if self.result is not None:
+        if self.result:
             return {
                 "country": self.country,
                 "region": self.region,
                 "city": self.city,
                 "asn": self.asn,
                 "org": self.org,
+                "latitude": self.latitude,
+                "longitude": self.longitude,
             }
         return None
 
-    def update_geo_info(self):
+    @classmethod
+    async def async_lookup_many(cls, session, ipaddrs):
+        """Look up several IP addresses, return computed results by IP.
+
+        Providers with a batch endpoint resolve up to batch_size addresses
+        per request, the others fall back to concurrent single lookups.
+        Addresses that were not looked up, because the circuit breaker of
+        the provider is open, are left out of the results.
+        """
+        if cls.batch_url is not None:
+            results = {}
+            for start in range(0, len(ipaddrs), cls.batch_size):
+                results.update(
+                    await cls.async_lookup_batch(
+                        session, ipaddrs[start : start + cls.batch_size]
+                    )
+                )
+            return results
+
+        semaphore = asyncio.Semaphore(PARALLEL_LOOKUPS)
+
+        async def async_lookup(ipaddr):
+            geo_data = cls(ipaddr)
+            async with semaphore:
+                try:
+                    await geo_data.async_update_geo_info(session)
+                except ProviderUnavailableException:
+                    return None
+            return ipaddr, geo_data.computed_result
+
+        return dict(
+            result
+            for result in await asyncio.gather(*(async_lookup(ip) for ip in ipaddrs))
+            if result is not None
+        )
+
+    @classmethod
+    def circuit_breaker(cls):
+        """Return the circuit breaker shared by all lookups of this provider."""
+        if cls.name not in BREAKERS:
+            BREAKERS[cls.name] = CircuitBreaker(cls.name)
+        return BREAKERS[cls.name]
+
+    @classmethod
+    async def async_request(cls, session, method, url, **kwargs):
+        """Send a request to the provider and return the decoded JSON.
+
+        Rate limits and server errors are retried up to RETRIES times,
+        waiting for Retry-After when the provider sends it and for a
+        jittered exponential backoff otherwise. Connection errors and
+        timeouts are retried the same way.
+        """
+        breaker = cls.circuit_breaker()
+        for attempt in range(RETRIES + 1):
+            if not breaker.allow():
+                METRICS.count("provider_circuit_open")
+                raise ProviderUnavailableException(f"{cls.name} is paused")
+            if attempt:
+                METRICS.count("provider_retry")
+            METRICS.count("geo_requests")
+            wait = None
+            try:
+                async with session.request(
+                    method, url, timeout=TIMEOUT, **kwargs
+                ) as response:
+                    if response.status not in RETRY_STATUSES:
+                        breaker.success()
+                        return await response.json(content_type=None)
+                    status = response.status
+                    wait = retry_after(response.headers.get("Retry-After"))
+            except (aiohttp.ClientError, TimeoutError):
+                if attempt == RETRIES:
+                    breaker.failure()
+                    raise
+                status = None
+
+            if wait is None:
+                wait = BACKOFF * 2**attempt * random.uniform(0.5, 1.5)
+            if attempt == RETRIES or wait > MAX_RETRY_DELAY:
+                break
+            await asyncio.sleep(wait)
+
+        if status == 429:
+            METRICS.count("provider_rate_limited")
+            breaker.failure(wait if wait > MAX_RETRY_DELAY else None)
+            raise AuthenticatedBaseException(
+                f"Rate limited by {cls.name}, try a different provider."
+            )
+        breaker.failure()
+        raise AuthenticatedBaseException(f"{cls.name} answered with HTTP {status}")
+
+    @classmethod
+    async def async_lookup_batch(cls, session, ipaddrs):
+        """Look up a batch of IP addresses with a single request."""
+        results = {}
+        try:
+            data = await cls.async_request(session, "post", cls.batch_url, json=ipaddrs)
+        except ProviderUnavailableException:
+            return results
+        except AuthenticatedBaseException as exception:
+            _LOGGER.error(exception)
+            return results
+        except (aiohttp.ClientError, TimeoutError, ValueError):
+            METRICS.count("provider_error")
+            return results
+
+        if not isinstance(data, list):
+            METRICS.count("provider_error")
+            _LOGGER.error("Batch lookup failed: %s", data)
+            return results
+
+        for ipaddr, item in zip(ipaddrs, data, strict=False):
+            geo_data = cls(ipaddr)
+            try:
+                geo_data.handle_data(item)
+            except AuthenticatedBaseException as exception:
+                _LOGGER.error(exception)
+            results[ipaddr] = geo_data.computed_result
+        return results
+
+    async def async_update_geo_info(self, session):
         """Update Geo Information."""
         self.result = {}
         try:
-            api = self.url.format(self.ipaddr)
-            data = requests.get(api, timeout=5).json()
-
-            _LOGGER.debug(data)
-
-            if data.get("error"):
-                if data.get("reason") == "RateLimited":
-                    raise AuthenticatedBaseException(
-                        "RatelimitError, try a different provider."
-                    )
+            data = await self.async_request(
+                session, "get", self.url.format(self.ipaddr)
+            )
+            self.handle_data(data)
+        except ProviderUnavailableException:
+            raise
+        except AuthenticatedBaseException as exception:
+            _LOGGER.error(exception)
+        except (aiohttp.ClientError, TimeoutError, ValueError):
+            METRICS.count("provider_error")
 
-            elif data.get("status", "success") == "error" or data.get("reserved"):
-                return
+    def handle_data(self, data):
+        """Check a response from the geoprovider and store its data."""
+        _LOGGER.debug(data)
 
-            elif data.get("status", "success") == "fail":
+        if data.get("error"):
+            if data.get("reason") == "RateLimited":
+                METRICS.count("provider_rate_limited")
                 raise AuthenticatedBaseException(
-                    "[{}] - {}".format(
-                        self.ipaddr, data.get("message", "Unknown error.")
-                    )
+                    "RatelimitError, try a different provider."
                 )
 
-            self.result = data
-            self.parse_data()
-        except AuthenticatedBaseException as exception:
-            _LOGGER.error(exception)
-        except requests.exceptions.ConnectionError:
-            pass
+        elif data.get("status", "success") == "error" or data.get("reserved"):
+            return
+
+        elif data.get("status", "success") == "fail":
+            METRICS.count("provider_error")
+            raise AuthenticatedBaseException(
+                "[{}] - {}".format(self.ipaddr, data.get("message", "Unknown error."))
+            )
+
+        self.result = data
+        self.parse_data()
 
     def parse_data(self):
         """Parse data from geoprovider."""
@@ -134,3 +411,103 @@ class IPInfo(GeoProvider):
         org = self.result.get("org")
         _LOGGER.debug(f"ORG: {org}")
         return org.split(" ", 1)[1] if org else None
+
+    @property
+    def latitude(self):
+        """Return latitude or None."""
+        loc = self.result.get("loc")
+        return coordinate(loc.split(",")[0]) if loc else None
+
+    @property
+    def longitude(self):
+        """Return longitude or None."""
+        loc = self.result.get("loc")
+        return coordinate(loc.split(",")[-1]) if loc else None
+
+
+@register_provider
+class IPApiCom(GeoProvider):
+    """IP-API class."""
+
+    fields = "status,message,country,regionName,city,lat,lon,as,org,isp,query"
+    url = f"http://ip-api.com/json/{{}}?fields={fields}"
+    batch_url = f"http://ip-api.com/batch?fields={fields}"
+    name = "ip-api"
+    # The free tier has no HTTPS, only use it when configured explicitly.
+    secure = False
+
+    @property
+    def region(self):
+        """Return region name or None."""
+        return self.result.get("regionName")
+
+    @property
+    def asn(self):
+        """Return ASN or None."""
+        asn = self.result.get("as")
+        return asn.split(" ", 1)[0] if asn else None
+
+    @property
+    def org(self):
+        """Return organisation name or None."""
+        return self.result.get("org") or self.result.get("isp")
+
+    @property
+    def latitude(self):
+        """Return latitude or None."""
+        return coordinate(self.result.get("lat"))
+
+    @property
+    def longitude(self):
+        """Return longitude or None."""
+        return coordinate(self.result.get("lon"))
+
+
+@register_provider
+class LocalDatabase(GeoProvider):
+    """Local range database class."""
+
+    name = "local"
+    cacheable = False
+    database = None
+
+    @classmethod
+    def set_database(cls, path):
+        """Use the CSV range database at path for lookups."""
+        if cls.database is not None:
+            cls.database.close()
+        cls.database = RangeDatabase(path)
+
+    @classmethod
+    async def async_load_database(cls):
+        """Build the range index in the executor on first use."""
+        if cls.database is None:
+            _LOGGER.error("No local_database configured for the local provider")
+            return False
+        if not cls.database.loaded:
+            try:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, cls.database.load
+                )
+            except OSError as exception:
+                _LOGGER.error("Unable to load %s: %s", cls.database.path, exception)
+                return False
+        return True
+
+    @classmethod
+    async def async_lookup_many(cls, session, ipaddrs):
+        """Look up several IP addresses in the local database."""
+        if not await cls.async_load_database():
+            return {}
+        results = {}
+        for ipaddr in ipaddrs:
+            geo_data = cls(ipaddr)
+            geo_data.result = cls.database.lookup(ipaddr) or {}
+            results[ipaddr] = geo_data.computed_result
+        return results
+
+    async def async_update_geo_info(self, session):
+        """Update Geo Information."""
+        self.result = {}
+        if await self.async_load_database():
+            self.result = self.database.lookup(self.ipaddr) or {}
@@ -0,0 +1,107 @@
+"""Reverse DNS resolver."""
+
+import asyncio
+import logging
+import socket
+import time
+from collections import OrderedDict
+
+try:
+    import aiodns
+except ImportError:
+    aiodns = None
+
+from .metrics import METRICS
+
+_LOGGER = logging.getLogger(__name__)
+
+CACHE_SIZE = 4096
+POSITIVE_TTL = 24 * 60 * 60
+NEGATIVE_TTL = 60 * 60
+PARALLEL_QUERIES = 8
+
+
+class HostnameResolver:
+    """Resolve hostnames for IP addresses with a timeout and a TTL cache.
+
+    PTR queries go through aiodns when it is installed, otherwise through
+    the system resolver in the executor. Addresses without a hostname are
+    cached as well, so they are not queried again until the entry expires.
+    """
+
+    def __init__(self, timeout):
+        """Initialize."""
+        self.timeout = timeout
+        self.cache = OrderedDict()
+        self.resolver = None
+
+    def cached(self, ip_address):
+        """Return (hit, hostname) from the cache."""
+        entry = self.cache.get(ip_address)
+        if entry is None:
+            return False, None
+        hostname, expires = entry
+        if expires <= time.monotonic():
+            del self.cache[ip_address]
+            return False, None
+        self.cache.move_to_end(ip_address)
+        return True, hostname
+
+    def store(self, ip_address, hostname):
+        """Cache a result, None for addresses without a hostname."""
+        ttl = POSITIVE_TTL if hostname is not None else NEGATIVE_TTL
+        self.cache[ip_address] = (hostname, time.monotonic() + ttl)
+        self.cache.move_to_end(ip_address)
+        while len(self.cache) > CACHE_SIZE:
+            self.cache.popitem(last=False)
+
+    async def async_resolve(self, ip_address):
+        """Return the hostname for an IP address, or None."""
+        hit, hostname = self.cached(ip_address)
+        if hit:
+            METRICS.count("dns_cache_hit")
+            return hostname
+        METRICS.count("dns_cache_miss")
+
+        try:
+            with METRICS.timer("hostname_lookup"):
+                hostname = await asyncio.wait_for(
+                    self.async_query(ip_address), self.timeout
+                )
+        except Exception as exception:  # pylint: disable=broad-except
+            # Timeouts, resolver errors and addresses without a PTR record.
+            _LOGGER.debug("No hostname for %s: %s", ip_address, exception)
+            METRICS.count(
+                "dns_timeout" if isinstance(exception, TimeoutError) else "dns_failure"
+            )
+            hostname = None
+
+        self.store(ip_address, hostname)
+        return hostname
+
+    async def async_resolve_many(self, ip_addresses):
+        """Resolve several IP addresses concurrently, return hostnames by IP."""
+        semaphore = asyncio.Semaphore(PARALLEL_QUERIES)
+
+        async def async_resolve(ip_address):
+            async with semaphore:
+                return ip_address, await self.async_resolve(ip_address)
+
+        return dict(
+            await asyncio.gather(
+                *(async_resolve(ip) for ip in dict.fromkeys(ip_addresses))
+            )
+        )
+
+    async def async_query(self, ip_address):
+        """Run the PTR query."""
+        loop = asyncio.get_running_loop()
+        if aiodns is not None:
+            if self.resolver is None:
+                self.resolver = aiodns.DNSResolver(
+                    loop=loop, timeout=self.timeout, tries=1
+                )
+            return (await self.resolver.gethostbyaddr(ip_address)).name
+
+        hostname, _ = await loop.getnameinfo((ip_address, 0), socket.NI_NAMEREQD)
+        return hostname
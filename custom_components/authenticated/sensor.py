@@ -4,34 +4,81 @@ For more details about this component, please refer to the documentation at
 https://github.com/custom-components/authenticated
 """
 
-import json
+import asyncio
+import heapq
 import logging
 import os
-import socket
-from contextlib import suppress
-from datetime import datetime, timedelta
+import time
+from datetime import UTC, datetime, timedelta
 from ipaddress import ip_address as ValidateIP
-from ipaddress import ip_network
 
 import homeassistant.helpers.config_validation as cv
 import voluptuous as vol
-import yaml
-from homeassistant.components.persistent_notification import async_create
 from homeassistant.components.sensor import PLATFORM_SCHEMA
+from homeassistant.const import EntityCategory
+from homeassistant.core import SupportsResponse, callback
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
 from homeassistant.helpers.entity import Entity
+from homeassistant.helpers.event import async_call_later
+from homeassistant.util import dt as dt_util
 
 from .const import (
+    CONF_DNS_TIMEOUT,
     CONF_EXCLUDE,
     CONF_EXCLUDE_CLIENTS,
+    CONF_GEO_CACHE_DAYS,
+    CONF_GEO_CACHE_SIZE,
+    CONF_GEO_PREFIX_HOURS,
+    CONF_GEO_PREFIX_IPV4,
+    CONF_GEO_PREFIX_IPV6,
+    CONF_GEO_PREFIX_SHARING,
+    CONF_GEO_PREFIX_VERIFY,
+    CONF_HEDGE_DELAY,
+    CONF_HISTORY_SIZE,
+    CONF_LOCAL_DATABASE,
+    CONF_LOG_BACKUPS,
     CONF_LOG_LOCATION,
+    CONF_LOG_MAX_DAYS,
+    CONF_LOG_MAX_SIZE,
+    CONF_MAX_AGE_DAYS,
+    CONF_MAX_ENTRIES,
+    CONF_METRICS,
     CONF_NOTIFY,
     CONF_NOTIFY_ECLUDE_ASN,
     CONF_NOTIFY_ECLUDE_HOSTNAMES,
+    CONF_NOTIFY_MAX_PER_HOUR,
+    CONF_NOTIFY_MIN_SCORE,
+    CONF_NOTIFY_WINDOW,
     CONF_PROVIDER,
+    CONF_SAVE_DELAY,
+    CONF_STORAGE,
+    CONF_USER_SENSORS,
+    CONF_WATCH,
+    DOMAIN,
     OUTFILE,
+    OUTFILE_DB,
+    SERVICE_QUERY_LOGINS,
     STARTUP,
 )
-from .providers import PROVIDERS
+from .anomaly import score_logins
+from .auditlog import LoginLog
+from .authstore import iter_auth_store
+from .cache import NEGATIVE_TTL, GeoCache, PrefixCache
+from .exclude import ExclusionMatcher
+from .history import HISTORY_SIZE, LoginHistory
+from .index import LoginIndex
+from .metrics import METRICS
+from .notify import NotificationQueue
+from .providers import (
+    PROVIDERS,
+    LocalDatabase,
+    async_lookup_hedged,
+    coordinate,
+    warn_insecure,
+)
+from .resolver import HostnameResolver
+from .store import FIELDS, DelayedWriter, SqliteStore, YamlStore
+from .watcher import FileWatcher
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -41,18 +88,43 @@ ATTR_REGION = "region"
 ATTR_CITY = "city"
 ATTR_ASN = "asn"
 ATTR_ORG = "org"
+ATTR_SCORE = "score"
+ATTR_TRAVEL_SPEED = "travel_speed"
 ATTR_NEW_IP = "new_ip"
 ATTR_LAST_AUTHENTICATE_TIME = "last_authenticated_time"
 ATTR_PREVIOUS_AUTHENTICATE_TIME = "previous_authenticated_time"
+ATTR_LOGINS_LAST_DAY = "logins_last_24h"
 ATTR_USER = "username"
+ATTR_USER_ID = "user_id"
+ATTR_IP_ADDRESS = "ip_address"
+ATTR_SINCE = "since"
+ATTR_UNTIL = "until"
+ATTR_OFFSET = "offset"
+ATTR_LIMIT = "limit"
+ATTR_WINDOW = "window"
+ATTR_LOGINS_IN_WINDOW = "logins_in_window"
+ATTR_LOGINS_PER_HOUR = "logins_per_hour"
+ATTR_LOGINS = "logins"
+ATTR_COUNTRIES = "countries"
 
 SCAN_INTERVAL = timedelta(minutes=1)
+WATCH_DELAY = 1
+PRUNE_BATCH = 100
+ENRICH_BATCH = 100
+QUERY_LIMIT = 50
+MAX_QUERY_LIMIT = 1000
 
 PLATFORM_NAME = "authenticated"
 PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(
     {
-        vol.Optional(CONF_PROVIDER, default="ipinfo"): vol.In(list(PROVIDERS.keys())),
+        vol.Optional(CONF_PROVIDER, default="ipinfo"): vol.All(
+            cv.ensure_list, [vol.In(list(PROVIDERS.keys()))], vol.Length(min=1)
+        ),
+        vol.Optional(CONF_HEDGE_DELAY): cv.positive_float,
         vol.Optional(CONF_LOG_LOCATION, default=""): cv.string,
+        vol.Optional(CONF_LOG_MAX_SIZE, default=10): cv.positive_int,
+        vol.Optional(CONF_LOG_BACKUPS, default=5): cv.positive_int,
+        vol.Optional(CONF_LOG_MAX_DAYS): cv.positive_int,
         vol.Optional(CONF_NOTIFY, default=True): cv.boolean,
         vol.Optional(CONF_NOTIFY_ECLUDE_ASN, default=[]): vol.All(
             cv.ensure_list, [cv.string]
@@ -60,20 +132,73 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(
         vol.Optional(CONF_NOTIFY_ECLUDE_HOSTNAMES, default=[]): vol.All(
             cv.ensure_list, [cv.string]
         ),
+        vol.Optional(CONF_NOTIFY_WINDOW, default=5): cv.positive_int,
+        vol.Optional(CONF_NOTIFY_MAX_PER_HOUR, default=20): cv.positive_int,
+        vol.Optional(CONF_NOTIFY_MIN_SCORE, default=0): vol.All(
+            vol.Coerce(float), vol.Range(min=0, max=1)
+        ),
         vol.Optional(CONF_EXCLUDE, default=[]): vol.All(cv.ensure_list, [cv.string]),
         vol.Optional(CONF_EXCLUDE_CLIENTS, default=[]): vol.All(
             cv.ensure_list, [cv.string]
         ),
+        vol.Optional(CONF_WATCH, default=True): cv.boolean,
+        vol.Optional(CONF_GEO_CACHE_DAYS, default=30): cv.positive_int,
+        vol.Optional(CONF_GEO_CACHE_SIZE, default=5000): cv.positive_int,
+        vol.Optional(CONF_GEO_PREFIX_SHARING, default=False): cv.boolean,
+        vol.Optional(CONF_GEO_PREFIX_IPV4, default=24): vol.All(
+            vol.Coerce(int), vol.Range(min=8, max=32)
+        ),
+        vol.Optional(CONF_GEO_PREFIX_IPV6, default=48): vol.All(
+            vol.Coerce(int), vol.Range(min=16, max=128)
+        ),
+        vol.Optional(CONF_GEO_PREFIX_HOURS, default=24): cv.positive_int,
+        vol.Optional(CONF_GEO_PREFIX_VERIFY, default=False): cv.boolean,
+        vol.Optional(CONF_LOCAL_DATABASE): cv.string,
+        vol.Optional(CONF_DNS_TIMEOUT, default=3): vol.All(
+            vol.Coerce(float), vol.Range(min=0.1)
+        ),
+        vol.Optional(CONF_STORAGE, default="yaml"): vol.In(["yaml", "sqlite"]),
+        vol.Optional(CONF_SAVE_DELAY, default=10): cv.positive_int,
+        vol.Optional(CONF_MAX_AGE_DAYS): cv.positive_int,
+        vol.Optional(CONF_MAX_ENTRIES, default=10000): vol.All(
+            vol.Coerce(int), vol.Range(min=1)
+        ),
+        vol.Optional(CONF_HISTORY_SIZE, default=HISTORY_SIZE): vol.All(
+            vol.Coerce(int), vol.Range(min=1)
+        ),
+        vol.Optional(CONF_METRICS, default=False): cv.boolean,
+        vol.Optional(CONF_USER_SENSORS, default=False): cv.boolean,
+    }
+)
+
+QUERY_SCHEMA = vol.Schema(
+    {
+        vol.Optional(ATTR_USER_ID): cv.string,
+        vol.Optional(ATTR_USER): cv.string,
+        vol.Optional(ATTR_ASN): cv.string,
+        vol.Optional(ATTR_COUNTRY): cv.string,
+        vol.Optional(ATTR_SINCE): cv.datetime,
+        vol.Optional(ATTR_UNTIL): cv.datetime,
+        vol.Optional(ATTR_WINDOW, default=timedelta(days=1)): cv.positive_time_period,
+        vol.Optional(ATTR_OFFSET, default=0): cv.positive_int,
+        vol.Optional(ATTR_LIMIT, default=QUERY_LIMIT): vol.All(
+            vol.Coerce(int), vol.Range(min=1, max=MAX_QUERY_LIMIT)
+        ),
     }
 )
 
 
-def humanize_time(timestring):
-    """Convert time."""
-    return datetime.strptime(timestring[:19], "%Y-%m-%dT%H:%M:%S")
+def timestamp(timestring):
+    """Convert a stored time to a sortable UTC timestamp, 0 if unknown."""
+    try:
+        return (
+            datetime.fromisoformat(str(timestring)[:19]).replace(tzinfo=UTC).timestamp()
+        )
+    except ValueError:
+        return 0
 
 
-def setup_platform(hass, config, add_devices, discovery_info=None):
+async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
     """Print startup message."""
     _LOGGER.info(STARTUP)
 
@@ -81,30 +206,96 @@ def setup_platform(hass, config, add_devices, discovery_info=None):
     notify = config.get(CONF_NOTIFY)
     notify_exclude_asn = config.get(CONF_NOTIFY_ECLUDE_ASN)
     notify_exclude_hostnames = config.get(CONF_NOTIFY_ECLUDE_HOSTNAMES)
-    exclude = config.get(CONF_EXCLUDE)
-    exclude_clients = config.get(CONF_EXCLUDE_CLIENTS)
+    exclusions = ExclusionMatcher(
+        config.get(CONF_EXCLUDE), config.get(CONF_EXCLUDE_CLIENTS)
+    )
     hass.data[PLATFORM_NAME] = {}
 
-    if not load_authentications(
-        hass.config.path(".storage/auth"), exclude, exclude_clients
-    ):
+    LoginHistory.maxlen = config[CONF_HISTORY_SIZE]
+    METRICS.enabled = config[CONF_METRICS]
+    METRICS.reset()
+
+    if config[CONF_STORAGE] == "sqlite":
+        store = SqliteStore(hass.config.path(OUTFILE_DB), hass.config.path(OUTFILE))
+    else:
+        store = YamlStore(hass.config.path(OUTFILE))
+
+    if CONF_LOCAL_DATABASE in config:
+        LocalDatabase.set_database(hass.config.path(config[CONF_LOCAL_DATABASE]))
+    elif LocalDatabase.name in config[CONF_PROVIDER]:
+        _LOGGER.critical("The local provider needs %s", CONF_LOCAL_DATABASE)
         return False
+    warn_insecure(config[CONF_PROVIDER])
 
-    out = str(hass.config.path(OUTFILE))
+    geo_cache = GeoCache(
+        hass,
+        timedelta(days=config[CONF_GEO_CACHE_DAYS]).total_seconds(),
+        config[CONF_GEO_CACHE_SIZE],
+    )
+    await geo_cache.async_load()
+
+    prefix_cache = None
+    if config[CONF_GEO_PREFIX_SHARING]:
+        prefix_cache = PrefixCache(
+            config[CONF_GEO_PREFIX_IPV4],
+            config[CONF_GEO_PREFIX_IPV6],
+            timedelta(hours=config[CONF_GEO_PREFIX_HOURS]).total_seconds(),
+        )
+
+    login_log = None
+    if config[CONF_LOG_LOCATION]:
+        login_log = LoginLog(
+            hass,
+            hass.config.path(config[CONF_LOG_LOCATION]),
+            config[CONF_LOG_MAX_SIZE] * 1024 * 1024,
+            config[CONF_LOG_BACKUPS],
+            timedelta(days=config[CONF_LOG_MAX_DAYS]).total_seconds()
+            if CONF_LOG_MAX_DAYS in config
+            else None,
+        )
 
     sensor = AuthenticatedSensor(
         hass,
         notify,
-        out,
-        exclude,
-        exclude_clients,
+        store,
+        exclusions,
         notify_exclude_asn,
         notify_exclude_hostnames,
         config[CONF_PROVIDER],
+        config[CONF_WATCH],
+        geo_cache,
+        HostnameResolver(config[CONF_DNS_TIMEOUT]),
+        NotificationQueue(
+            hass, config[CONF_NOTIFY_WINDOW], config[CONF_NOTIFY_MAX_PER_HOUR]
+        ),
+        config[CONF_SAVE_DELAY],
+        config.get(CONF_MAX_AGE_DAYS),
+        config[CONF_MAX_ENTRIES],
+        config.get(CONF_HEDGE_DELAY),
+        prefix_cache,
+        config[CONF_GEO_PREFIX_VERIFY],
+        login_log,
+        config[CONF_NOTIFY_MIN_SCORE],
+    )
+    if not await sensor.auth.async_load(hass):
+        return False
+    await sensor.async_initial_run()
+
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_QUERY_LOGINS,
+        sensor.async_query_logins,
+        schema=QUERY_SCHEMA,
+        supports_response=SupportsResponse.ONLY,
     )
-    sensor.initial_run()
 
-    add_devices([sensor], True)
+    entities = [sensor]
+    if METRICS.enabled:
+        entities.append(AuthenticatedMetricsSensor())
+    if config[CONF_USER_SENSORS]:
+        sensor.async_add_user_sensors = async_add_entities
+        entities.extend(sensor.new_user_sensors(sensor.auth.users))
+    async_add_entities(entities, True)
 
 
 class AuthenticatedSensor(Entity):
@@ -114,37 +305,75 @@ class AuthenticatedSensor(Entity):
         self,
         hass,
         notify,
-        out,
-        exclude,
-        exclude_clients,
+        store,
+        exclusions,
         notify_exclude_asn,
         notify_exclude_hostnames,
         provider,
+        watch,
+        geo_cache,
+        resolver,
+        notifications,
+        save_delay,
+        max_age_days,
+        max_entries,
+        hedge_delay=None,
+        prefix_cache=None,
+        verify_prefixes=False,
+        login_log=None,
+        notify_min_score=0,
     ):
         """Initialize the sensor."""
         self.hass = hass
         self._state = None
         self.provider = provider
+        self.hedge_delay = hedge_delay
+        self.geo_cache = geo_cache
+        self.prefix_cache = prefix_cache
+        self.verify_prefixes = verify_prefixes
+        self.resolver = resolver
+        self.notifications = notifications
+        self.login_log = login_log
         self.stored = {}
+        self.lookups = []
+        self.retries = {}
+        self.enrich_task = None
         self.last_ip = None
-        self.exclude = exclude
-        self.exclude_clients = exclude_clients
+        self.auth = AuthFile(hass.config.path(".storage/auth"), exclusions)
         self.notify = notify
         self.notify_exclude_asn = notify_exclude_asn
         self.notify_exclude_hostnames = notify_exclude_hostnames
-        self.out = out
-
-    def initial_run(self):
-        """Run this at startup to initialize the platform data."""
-        users, tokens = load_authentications(
-            self.hass.config.path(".storage/auth"), self.exclude, self.exclude_clients
+        self.notify_min_score = notify_min_score
+        self.store = store
+        self.writer = DelayedWriter(hass, store, save_delay)
+        self.dirty = set()
+        self.removed = set()
+        self.index = LoginIndex()
+        self.max_age = (
+            timedelta(days=max_age_days).total_seconds() if max_age_days else None
         )
+        self.max_entries = max_entries
+        self.watch = watch
+        self.update_lock = asyncio.Lock()
+        self.unsub_watch_update = None
+        self.user_sensors = {}
+        self.async_add_user_sensors = None
+
+    async def async_initial_run(self):
+        """Initialize the platform data from the auth store and stored data.
+
+        Nothing is looked up here, so the sensor can be added right away.
+        New IP addresses are queued for async_enrich, which runs in the
+        background once the sensor has been added, and are only stored
+        once it has looked them up. Stored addresses without geo data are
+        queued for a retry.
+        """
+        users, tokens = self.auth.users, self.auth.tokens
 
-        if os.path.isfile(self.out):
-            self.stored = get_outfile_content(self.out)
-        else:
-            _LOGGER.debug("File has not been created, no data pressent.")
+        self.stored = await self.hass.async_add_executor_job(self.store.load)
 
+        lookups = []
+        caught_up = []
         for access in tokens:
             try:
                 ValidateIP(access)
@@ -154,60 +383,235 @@ class AuthenticatedSensor(Entity):
             accessdata = AuthenticatedData(access, tokens[access])
 
             if accessdata.ipaddr in self.stored:
-                store = AuthenticatedData(accessdata.ipaddr, self.stored[access])
+                accessdata.update_from(
+                    AuthenticatedData(accessdata.ipaddr, self.stored[access])
+                )
                 accessdata.ipaddr = access
 
-                if store.user_id is not None:
-                    accessdata.user_id = store.user_id
-
-                if store.hostname is not None:
-                    accessdata.hostname = store.hostname
-
-                if store.country is not None:
-                    accessdata.country = store.country
-
-                if store.region is not None:
-                    accessdata.region = store.region
-
-                if store.city is not None:
-                    accessdata.city = store.city
+            ipaddress = IPData(accessdata, users, self.provider, False)
+            if accessdata.ipaddr not in self.stored:
+                ipaddress.add_login()
+                lookups.append(ipaddress)
+            elif timestamp(tokens[access]["last_used_at"]) > ipaddress.last_used_ts:
+                # Logged in while Home Assistant was not running.
+                ipaddress.prev_used_at = ipaddress.last_used_at
+                ipaddress.last_used_at = tokens[access]["last_used_at"]
+                ipaddress.add_login(tokens[access].get("user_id"))
+                caught_up.append(ipaddress)
+            self.hass.data[PLATFORM_NAME][access] = ipaddress
+        self.dirty.update(ipaddress.ip_address for ipaddress in caught_up)
 
-                if store.asn is not None:
-                    accessdata.asn = store.asn
+        self.load_unused(users)
+        self.stored = {}
+        self.lookups = lookups
+
+        new = {ipaddress.ip_address for ipaddress in lookups}
+        for ipaddress in self.hass.data[PLATFORM_NAME].values():
+            self.index.update(ipaddress)
+            if ipaddress.ip_address not in new and ipaddress.needs_geo:
+                # Stored before a lookup succeeded.
+                self.retries[ipaddress.ip_address] = 0
+            if self.prefix_cache is not None and ipaddress.country is not None:
+                self.prefix_cache.set(
+                    ipaddress.ip_address, ipaddress.geo, ipaddress.last_used_ts
+                )
+        self.score()
+        if self.login_log is not None:
+            for ipaddress in caught_up:
+                self.login_log.async_log(
+                    ipaddress, tokens[ipaddress.ip_address].get("user_id")
+                )
+        self.update_last_ip(
+            self.hass.data[PLATFORM_NAME][access]
+            for access in tokens
+            if access in self.hass.data[PLATFORM_NAME]
+        )
+        self.prune()
+        self.async_write_to_file()
 
-                if store.org is not None:
-                    accessdata.org = store.org
+    def load_unused(self, users):
+        """Load stored addresses no longer used by any refresh token.
 
-                if store.last_access is not None:
-                    accessdata.last_access = store.last_access
-                elif store.attributes.get("last_authenticated") is not None:
-                    accessdata.last_access = store.attributes["last_authenticated"]
-                elif store.attributes.get("last_used_at") is not None:
-                    accessdata.last_access = store.attributes["last_used_at"]
+        Only addresses within the retention limits are kept in memory, the
+        others are removed from the store.
+        """
+        known = self.hass.data[PLATFORM_NAME]
+        cutoff = datetime.now(UTC).timestamp() - (self.max_age or 0)
+        unused = []
+        for ipaddr, stored in self.stored.items():
+            ipaddr = str(ipaddr)
+            if ipaddr in known or not isinstance(stored, dict):
+                continue
+            try:
+                ValidateIP(ipaddr)
+            except ValueError:
+                continue
+            accessdata = AuthenticatedData(ipaddr, stored)
+            if accessdata.last_access is None:
+                accessdata.last_access = stored.get("last_authenticated")
+            if accessdata.prev_access is None:
+                accessdata.prev_access = stored.get("previous_authenticated_time")
+            ipaddress = IPData(accessdata, users, self.provider, False)
+            if self.max_age is not None and ipaddress.last_used_ts < cutoff:
+                self.removed.add(ipaddr)
+            else:
+                unused.append(ipaddress)
+
+        room = len(unused)
+        if self.max_entries is not None:
+            room = max(min(room, self.max_entries - len(known)), 0)
+        unused.sort(key=lambda ipaddress: ipaddress.last_used_ts, reverse=True)
+        for ipaddress in unused[:room]:
+            known[ipaddress.ip_address] = ipaddress
+        self.removed.update(ipaddress.ip_address for ipaddress in unused[room:])
+        if self.removed:
+            _LOGGER.debug(
+                "Removing %s stored IP addresses beyond the retention limits",
+                len(self.removed),
+            )
+
+    async def async_enrich(self):
+        """Look up geo data and hostnames for the queued IP addresses.
+
+        New addresses found at startup come first, then known addresses
+        that are due for another lookup. Addresses are handled in batches
+        of ENRICH_BATCH, each batch is stored and shown as soon as it is
+        done. The update lock is taken per batch, so new logins are still
+        processed in between.
+        """
+        lookups, self.lookups = self.lookups, []
+        new = {ipaddress.ip_address for ipaddress in lookups}
+        _LOGGER.debug("Looking up %s new IP addresses", len(lookups))
+        known = self.hass.data[PLATFORM_NAME]
+        now = time.monotonic()
+        for ipaddr, retry_at in list(self.retries.items()):
+            if retry_at <= now and ipaddr not in new:
+                del self.retries[ipaddr]
+                if ipaddr in known:
+                    lookups.append(known[ipaddr])
+        for start in range(0, len(lookups), ENRICH_BATCH):
+            async with self.update_lock:
+                known = self.hass.data[PLATFORM_NAME]
+                batch = [
+                    ipaddress
+                    for ipaddress in lookups[start : start + ENRICH_BATCH]
+                    if known.get(ipaddress.ip_address) is ipaddress
+                ]
+                if not batch:
+                    # Pruned while waiting for the lock.
+                    continue
+                await self.async_lookup_many(batch)
+                await self.async_resolve_hostnames(batch)
+                self.score(batch)
+                if self.login_log is not None:
+                    for ipaddress in batch:
+                        if ipaddress.ip_address in new:
+                            self.login_log.async_log(ipaddress, new_ip=True)
+                self.dirty.update(ipaddress.ip_address for ipaddress in batch)
+                self.async_write_to_file()
+                if self.entity_id is not None:
+                    self.async_write_ha_state()
+
+    @callback
+    def async_schedule_enrich(self):
+        """Run async_enrich in the background, unless it is running already."""
+        if self.enrich_task is None or self.enrich_task.done():
+            self.enrich_task = self.hass.async_create_background_task(
+                self.async_enrich(), f"{DOMAIN} lookups"
+            )
+
+    @callback
+    def async_cancel_enrich(self):
+        """Stop the background lookups."""
+        if self.enrich_task is not None:
+            self.enrich_task.cancel()
+            self.enrich_task = None
+
+    def queue_retries(self, ipaddresses):
+        """Queue public addresses still without geo data for another lookup.
+
+        Providers skip addresses while their circuit breaker is open, those
+        are looked up again once a provider of the chain takes requests.
+        When the whole chain answered without geo data, the retry waits for
+        the failed lookups to expire from the geo cache.
+        """
+        now = time.monotonic()
+        retry_at = min(
+            PROVIDERS[name].circuit_breaker().open_until for name in self.provider
+        )
+        if retry_at <= now:
+            retry_at = now + NEGATIVE_TTL
+        for ipaddress in ipaddresses:
+            if ipaddress.needs_geo:
+                self.retries[ipaddress.ip_address] = retry_at
+            else:
+                self.retries.pop(ipaddress.ip_address, None)
 
-                if store.prev_access is not None:
-                    accessdata.prev_access = store.prev_access
-                elif store.attributes.get("previous_authenticated_time") is not None:
-                    accessdata.prev_access = store.attributes[
-                        "previous_authenticated_time"
-                    ]
-                elif store.attributes.get("prev_used_at") is not None:
-                    accessdata.prev_access = store.attributes["prev_used_at"]
+    async def async_will_remove_from_hass(self):
+        """Write pending changes before the sensor is removed."""
+        self.notifications.async_close()
+        if self.login_log is not None:
+            await self.login_log.async_close()
+        await self.writer.async_close()
 
-            ipaddress = IPData(accessdata, users, self.provider, False)
-            if accessdata.ipaddr not in self.stored:
-                ipaddress.lookup()
-            self.hass.data[PLATFORM_NAME][access] = ipaddress
-        self.write_to_file()
+    async def async_added_to_hass(self):
+        """Start the lookups and watch the auth store for changes.
 
-    def update(self):
+        Polling remains as a fallback for the watcher.
+        """
+        self.async_on_remove(self.async_cancel_enrich)
+        if self.lookups or self.retries:
+            self.async_schedule_enrich()
+        if not self.watch:
+            return
+        watcher = FileWatcher(self.hass.loop, self.auth.path, self.async_auth_changed)
+        if watcher.start():
+            self.async_on_remove(watcher.stop)
+            self.async_on_remove(self.async_cancel_watch_update)
+
+    @callback
+    def async_auth_changed(self):
+        """Schedule an update shortly after the auth store was written."""
+        if self.unsub_watch_update is None:
+            self.unsub_watch_update = async_call_later(
+                self.hass, WATCH_DELAY, self.async_watch_update
+            )
+
+    @callback
+    def async_watch_update(self, _now):
+        """Update the sensor after the auth store was written."""
+        self.unsub_watch_update = None
+        self.async_schedule_update_ha_state(True)
+
+    @callback
+    def async_cancel_watch_update(self):
+        """Cancel a pending update from the file watcher."""
+        if self.unsub_watch_update is not None:
+            self.unsub_watch_update()
+            self.unsub_watch_update = None
+
+    async def async_update(self):
         """Update sensor value."""
+        async with self.update_lock:
+            with METRICS.timer("update"):
+                if await self.auth.async_load(self.hass):
+                    await self.async_process_changes()
+                # Retention limits also apply while nobody logs in.
+                if self.prune():
+                    self.async_write_to_file()
+            if self.entity_id is not None and any(
+                retry_at <= time.monotonic() for retry_at in self.retries.values()
+            ):
+                self.async_schedule_enrich()
+
+    async def async_process_changes(self):
+        """Process refresh tokens that changed since the last update."""
         updated = False
-        users, tokens = load_authentications(
-            self.hass.config.path(".storage/auth"), self.exclude, self.exclude_clients
-        )
+        users, tokens = self.auth.users, self.auth.changed
         _LOGGER.debug("Users %s", users)
         _LOGGER.debug("Access %s", tokens)
+        changed = []
+        lookups = []
         for access in tokens:
             try:
                 ValidateIP(access)
@@ -217,32 +621,45 @@ class AuthenticatedSensor(Entity):
             if access in self.hass.data[PLATFORM_NAME]:
                 ipaddress = self.hass.data[PLATFORM_NAME][access]
 
-                try:
-                    new = humanize_time(tokens[access]["last_used_at"])
-                    stored = humanize_time(ipaddress.last_used_at)
-
-                    if new == stored:
-                        continue
-                    if new is None or stored is None:
-                        continue
-                    if new > stored:
-                        updated = True
-                        _LOGGER.info("New successful login from known IP (%s)", access)
-                        ipaddress.prev_used_at = ipaddress.last_used_at
-                        ipaddress.last_used_at = tokens[access]["last_used_at"]
-                except Exception:  # pylint: disable=broad-except
-                    pass
+                if timestamp(tokens[access].get("last_used_at")) <= (
+                    ipaddress.last_used_ts
+                ):
+                    continue
+                updated = True
+                _LOGGER.info("New successful login from known IP (%s)", access)
+                ipaddress.prev_used_at = ipaddress.last_used_at
+                ipaddress.last_used_at = tokens[access]["last_used_at"]
+                ipaddress.add_login(tokens[access].get("user_id"))
+                if ipaddress.needs_geo:
+                    # An earlier lookup got no answer.
+                    lookups.append(ipaddress)
             else:
                 updated = True
                 _LOGGER.warning("New successful login from unknown IP (%s)", access)
                 accessdata = AuthenticatedData(access, tokens[access])
                 ipaddress = IPData(accessdata, users, self.provider)
-                ipaddress.lookup()
-
-            if ipaddress.hostname is None:
-                ipaddress.hostname = get_hostname(ipaddress.ip_address)
-
-            if ipaddress.new_ip:
+                ipaddress.add_login()
+                lookups.append(ipaddress)
+
+            changed.append(ipaddress)
+
+        await self.async_lookup_many(lookups)
+        await self.async_resolve_hostnames(changed)
+        self.score(changed)
+
+        for ipaddress in changed:
+            if self.login_log is not None:
+                self.login_log.async_log(
+                    ipaddress, tokens[ipaddress.ip_address].get("user_id")
+                )
+            if self.notify_min_score:
+                alert = (
+                    ipaddress.score is not None
+                    and ipaddress.score >= self.notify_min_score
+                )
+            else:
+                alert = ipaddress.new_ip
+            if alert:
                 if self.notify:
                     if ipaddress.asn in self.notify_exclude_asn:
                         # ASN is in exclude list
@@ -251,20 +668,234 @@ class AuthenticatedSensor(Entity):
                         # Host name is in exclude list
                         pass
                     else:
-                        ipaddress.notify(self.hass)
-                ipaddress.new_ip = False
+                        self.notifications.async_enqueue(ipaddress)
+            ipaddress.new_ip = False
 
-            self.hass.data[PLATFORM_NAME][access] = ipaddress
+            self.hass.data[PLATFORM_NAME][ipaddress.ip_address] = ipaddress
+            self.dirty.add(ipaddress.ip_address)
 
-        for ipaddr in sorted(
-            tokens, key=lambda x: tokens[x]["last_used_at"], reverse=True
-        ):
-            self.last_ip = self.hass.data[PLATFORM_NAME][ipaddr]
-            break
+        self.update_last_ip(
+            self.hass.data[PLATFORM_NAME][access]
+            for access in tokens
+            if access in self.hass.data[PLATFORM_NAME]
+        )
+        if updated:
+            self.async_write_to_file()
+        if self.async_add_user_sensors is not None:
+            sensors = self.new_user_sensors(
+                token.get("user_id") for token in tokens.values()
+            )
+            if sensors:
+                self.async_add_user_sensors(sensors, True)
+
+    def new_user_sensors(self, user_ids):
+        """Return sensors for the users that do not have one yet.
+
+        System generated users, such as the Supervisor, get none.
+        """
+        sensors = []
+        for user_id in user_ids:
+            if (
+                user_id is None
+                or user_id in self.user_sensors
+                or user_id in self.auth.system_users
+            ):
+                continue
+            self.user_sensors[user_id] = AuthenticatedUserSensor(self, user_id)
+            sensors.append(self.user_sensors[user_id])
+        return sensors
+
+    def prune(self):
+        """Forget IP addresses beyond the retention limits.
+
+        Addresses still in use by a refresh token are kept. At most
+        PRUNE_BATCH addresses are removed per call, so a large backlog is
+        worked off over several updates. Return True if any were removed.
+        """
+        if self.max_age is None and self.max_entries is None:
+            return False
+
+        known = self.hass.data[PLATFORM_NAME]
+        limit = PRUNE_BATCH
+        if self.max_age is None:
+            limit = min(limit, len(known) - self.max_entries)
+        if limit <= 0:
+            return False
+
+        oldest = heapq.nsmallest(
+            limit,
+            (
+                (ipaddress.last_used_ts, ipaddr)
+                for ipaddr, ipaddress in known.items()
+                if ipaddr not in self.auth.tokens
+            ),
+        )
+        cutoff = datetime.now(UTC).timestamp() - (self.max_age or 0)
+        excess = len(known) - self.max_entries if self.max_entries is not None else 0
+
+        removed = []
+        for used_at, ipaddr in oldest:
+            if self.max_age is not None and used_at < cutoff:
+                removed.append(ipaddr)
+            elif len(removed) < excess:
+                removed.append(ipaddr)
+            else:
+                break
+
+        for ipaddr in removed:
+            del known[ipaddr]
+            self.removed.add(ipaddr)
+            self.retries.pop(ipaddr, None)
+        if removed:
+            _LOGGER.debug("Pruned %s IP addresses", len(removed))
+            if self.last_ip is not None and self.last_ip.ip_address in removed:
+                self.last_ip = None
+                self.update_last_ip(known.values())
+        return bool(removed)
+
+    async def async_lookup_many(self, ipaddresses):
+        """Look up geo data for IP addresses in as few requests as possible.
+
+        With prefix sharing, addresses with a recently resolved neighbour
+        get its geo data instead, optionally verified in the background.
+        Addresses left without geo data are queued for a retry.
+        """
+        queued = ipaddresses
+        shared = []
+        if self.prefix_cache is not None:
+            lookups = []
+            for ipaddress in ipaddresses:
+                data = None
+                if ValidateIP(ipaddress.ip_address).is_global:
+                    data = self.prefix_cache.get(ipaddress.ip_address)
+                if data is None:
+                    lookups.append(ipaddress)
+                    continue
+                METRICS.count("geo_prefix_hit")
+                ipaddress.update_geo({"result": True, "data": data})
+                shared.append(ipaddress)
+            ipaddresses = lookups
+            if shared and self.verify_prefixes:
+                self.hass.async_create_background_task(
+                    self.async_verify_shared(shared), f"{DOMAIN} verify prefixes"
+                )
+
+        if not ipaddresses:
+            self.queue_retries(queued)
+            return
+        results = await async_get_geo_data_many(
+            async_get_clientsession(self.hass),
+            [ipaddress.ip_address for ipaddress in ipaddresses],
+            self.provider,
+            self.geo_cache,
+            self.hedge_delay,
+        )
+        for ipaddress in ipaddresses:
+            result = results[ipaddress.ip_address]
+            ipaddress.update_geo(result)
+            if self.prefix_cache is not None and result["result"]:
+                self.prefix_cache.set(ipaddress.ip_address, result["data"])
+        self.queue_retries(queued)
+
+    async def async_verify_shared(self, ipaddresses):
+        """Look up addresses that got geo data from a neighbour."""
+        results = await async_get_geo_data_many(
+            async_get_clientsession(self.hass),
+            [ipaddress.ip_address for ipaddress in ipaddresses],
+            self.provider,
+            self.geo_cache,
+        )
+        changed = False
+        for ipaddress in ipaddresses:
+            result = results[ipaddress.ip_address]
+            if not result["result"] or result["data"] == ipaddress.geo:
+                continue
+            METRICS.count("geo_prefix_mismatch")
+            _LOGGER.debug("Shared geo data for %s was wrong", ipaddress.ip_address)
+            ipaddress.update_geo(result)
+            self.prefix_cache.set(ipaddress.ip_address, result["data"])
+            if ipaddress.ip_address in self.hass.data[PLATFORM_NAME]:
+                self.dirty.add(ipaddress.ip_address)
+                changed = True
+        if changed:
+            self.async_write_to_file()
+
+    async def async_resolve_hostnames(self, ipaddresses):
+        """Resolve hostnames for IP addresses that do not have one yet."""
+        missing = [ipaddress for ipaddress in ipaddresses if ipaddress.hostname is None]
+        if not missing:
+            return
+        hostnames = await self.resolver.async_resolve_many(
+            [ipaddress.ip_address for ipaddress in missing]
+        )
+        for ipaddress in missing:
+            ipaddress.hostname = hostnames[ipaddress.ip_address]
+
+    def score(self, ipaddresses=None):
+        """Score the last login of IP addresses against their users' history.
+
+        Without ipaddresses all known addresses are scored. Otherwise the
+        logins of every address of the users involved are taken into
+        account, but only the given addresses get a new score.
+        """
+        known = self.hass.data[PLATFORM_NAME]
+        if ipaddresses is None:
+            targets = list(known.values())
+            records = targets
+        else:
+            targets = list(ipaddresses)
+            records = {ipaddress.ip_address: ipaddress for ipaddress in targets}
+            users = set().union(
+                *(self.index.keys(ipaddress)[0] for ipaddress in targets)
+            )
+            for user_id in users:
+                for ipaddr in self.index.by_user.get(user_id, ()):
+                    if ipaddr not in records and ipaddr in known:
+                        records[ipaddr] = known[ipaddr]
+            records = list(records.values())
+
+        logins = []
+        last = {}
+        for ipaddress in records:
+            for when, user_id in zip(
+                ipaddress.history.times, ipaddress.history.user_ids, strict=True
+            ):
+                user_id = user_id or ipaddress.user_id
+                if user_id is None:
+                    continue
+                last[ipaddress.ip_address] = len(logins)
+                logins.append(
+                    (
+                        user_id,
+                        when,
+                        ipaddress.latitude,
+                        ipaddress.longitude,
+                        ipaddress.country,
+                        ipaddress.asn,
+                    )
+                )
+        with METRICS.timer("score"):
+            scores = score_logins(logins)
+        for ipaddress in targets:
+            if ipaddress.ip_address in last:
+                ipaddress.score, ipaddress.travel_speed = scores[
+                    last[ipaddress.ip_address]
+                ]
+
+    def update_last_ip(self, ipaddresses):
+        """Point the sensor at the most recently used IP address.
+
+        Only the given addresses are compared against the current one, so
+        an update costs time in proportion to the changed refresh tokens.
+        """
+        for ipaddress in ipaddresses:
+            if (
+                self.last_ip is None
+                or ipaddress.last_used_ts > self.last_ip.last_used_ts
+            ):
+                self.last_ip = ipaddress
         if self.last_ip is not None:
             self._state = self.last_ip.ip_address
-        if updated:
-            self.write_to_file()
 
     @property
     def name(self):
@@ -293,92 +924,285 @@ class AuthenticatedSensor(Entity):
             ATTR_CITY: self.last_ip.city,
             ATTR_ASN: self.last_ip.asn,
             ATTR_ORG: self.last_ip.org,
+            ATTR_SCORE: self.last_ip.score,
+            ATTR_TRAVEL_SPEED: self.last_ip.travel_speed,
             ATTR_USER: self.last_ip.username,
             ATTR_NEW_IP: self.last_ip.new_ip,
             ATTR_LAST_AUTHENTICATE_TIME: self.last_ip.last_used_at,
             ATTR_PREVIOUS_AUTHENTICATE_TIME: self.last_ip.prev_used_at,
+            ATTR_LOGINS_LAST_DAY: self.last_ip.history.count_since(
+                datetime.now(UTC).timestamp() - 86400
+            ),
         }
 
-    def write_to_file(self):
-        """Write data to file."""
-        if os.path.exists(self.out):
-            info = get_outfile_content(self.out)
-        else:
-            info = {}
-
-        for known in self.hass.data[PLATFORM_NAME]:
-            known = self.hass.data[PLATFORM_NAME][known]
-            info[known.ip_address] = {
-                "user_id": known.user_id,
-                "username": known.username,
-                "last_used_at": known.last_used_at,
-                "prev_used_at": known.prev_used_at,
-                "country": known.country,
-                "hostname": known.hostname,
-                "region": known.region,
-                "city": known.city,
-                "asn": known.asn,
-                "org": known.org,
+    async def async_query_logins(self, call):
+        """Return known IP addresses matching the service call, newest first."""
+        user_ids = None
+        if ATTR_USER_ID in call.data or ATTR_USER in call.data:
+            user_ids = {
+                user_id
+                for user_id, name in self.auth.users.items()
+                if name == call.data.get(ATTR_USER)
             }
-        with open(self.out, "w") as out_file:
-            yaml.dump(info, out_file, default_flow_style=False, explicit_start=True)
+            if ATTR_USER_ID in call.data:
+                user_ids.add(call.data[ATTR_USER_ID])
+        since = call.data.get(ATTR_SINCE)
+        until = call.data.get(ATTR_UNTIL)
+        matches = self.index.query(
+            user_ids,
+            call.data.get(ATTR_ASN),
+            call.data.get(ATTR_COUNTRY),
+            None if since is None else dt_util.as_timestamp(since),
+            None if until is None else dt_util.as_timestamp(until),
+        )
+        offset, limit = call.data[ATTR_OFFSET], call.data[ATTR_LIMIT]
+        window = call.data[ATTR_WINDOW].total_seconds()
+        now = datetime.now(UTC).timestamp()
+        known = self.hass.data[PLATFORM_NAME]
+        return {
+            "total": len(matches),
+            ATTR_OFFSET: offset,
+            ATTR_LIMIT: limit,
+            "results": [
+                {
+                    ATTR_IP_ADDRESS: ipaddr,
+                    **{field: getattr(known[ipaddr], field) for field in FIELDS},
+                    ATTR_LOGINS: known[ipaddr].history.as_list(),
+                    ATTR_LOGINS_IN_WINDOW: known[ipaddr].history.count_since(
+                        now - window, user_ids
+                    ),
+                    ATTR_LOGINS_PER_HOUR: round(
+                        known[ipaddr].history.frequency(window, now, user_ids), 3
+                    ),
+                }
+                for ipaddr in matches[offset : offset + limit]
+            ],
+        }
 
+    @callback
+    def async_write_to_file(self):
+        """Index changed IP addresses and schedule them to be written."""
+        records = dict.fromkeys(self.removed)
+        for ipaddr in self.removed:
+            self.index.remove(ipaddr)
+        for ipaddr in self.dirty:
+            known = self.hass.data[PLATFORM_NAME].get(ipaddr)
+            if known is not None:
+                self.index.update(known)
+                records[ipaddr] = {field: getattr(known, field) for field in FIELDS}
+                records[ipaddr]["history"] = known.history.as_list()
+        self.dirty.clear()
+        self.removed.clear()
+        if records:
+            self.writer.async_schedule(records)
+
+
+async def async_get_geo_data_many(
+    session, ip_addresses, providers, cache=None, hedge_delay=None
+):
+    """Get geo data for several IPs, batching the ones that are not cached.
+
+    Providers are tried in order, addresses without a result from one are
+    looked up with the next. With a hedge_delay, the next provider is
+    asked as well when the current one is slower than that.
+    """
+    if isinstance(providers, str):
+        providers = [providers]
+    results = {}
+    pending = []
+    for ip_address in dict.fromkeys(ip_addresses):
+        results[ip_address] = {"result": False, "data": "none"}
+        if ValidateIP(ip_address).is_global:
+            # Private and reserved ranges have no geo data.
+            pending.append(ip_address)
+
+    asked = {provider: set() for provider in providers}
+    for index, provider in enumerate(providers):
+        lookups = []
+        for ip_address in pending:
+            if ip_address in asked[provider]:
+                continue
+            if cache is not None and PROVIDERS[provider].cacheable:
+                hit, data = cache.get(provider, ip_address)
+                if hit:
+                    if data is not None:
+                        results[ip_address] = {"result": True, "data": data}
+                    continue
+            lookups.append(ip_address)
+
+        if lookups:
+            with METRICS.timer("get_geo_data"):
+                answers = await async_lookup_hedged(
+                    session, lookups, providers[index:], hedge_delay
+                )
+            for name, found in answers.items():
+                asked[name].update(lookups)
+                for ip_address, data in found.items():
+                    if cache is not None and PROVIDERS[name].cacheable:
+                        # Addresses skipped by a provider are looked up next time.
+                        cache.set(name, ip_address, data)
+                    if data is not None and not results[ip_address]["result"]:
+                        results[ip_address] = {"result": True, "data": data}
+
+        pending = [ip for ip in pending if not results[ip]["result"]]
+        if not pending:
+            break
 
-def get_outfile_content(file):
-    """Get the content of the outfile."""
-    with open(file) as out_file:
-        content = yaml.load(out_file, Loader=yaml.FullLoader)
-    out_file.close()
+    return results
+
+
+class AuthenticatedMetricsSensor(Entity):
+    """Diagnostic sensor with timings and counters of the integration."""
+
+    @property
+    def name(self):
+        """Return the name of the sensor."""
+        return "Authenticated update duration"
 
-    if isinstance(content, dict):
-        return content
-    return {}
+    @property
+    def state(self):
+        """Return the duration of the last update in milliseconds."""
+        update = METRICS.timings.get("update")
+        return None if update is None else round(update.last, 1)
 
+    @property
+    def unit_of_measurement(self):
+        """Return the unit of measurement."""
+        return "ms"
 
-def get_geo_data(ip_address, provider):
-    """Get geo data for an IP."""
-    result = {"result": False, "data": "none"}
-    geo_data = PROVIDERS[provider](ip_address)
-    geo_data.update_geo_info()
+    @property
+    def icon(self):
+        """Return the icon of the sensor."""
+        return "mdi:timer-outline"
 
-    if geo_data.computed_result is not None:
-        result = {"result": True, "data": geo_data.computed_result}
+    @property
+    def entity_category(self):
+        """Return the entity category."""
+        return EntityCategory.DIAGNOSTIC
 
-    return result
+    @property
+    def extra_state_attributes(self):
+        """Return timings, counters and cache hit ratios."""
+        return METRICS.as_dict()
 
 
-def get_hostname(ip_address):
-    """Return hostname for an IP."""
-    hostname = None
-    with suppress(Exception):
-        hostname = socket.getfqdn(ip_address)
-    return hostname
+class AuthenticatedUserSensor(Entity):
+    """Known IP addresses of one user, from the login index."""
 
+    def __init__(self, sensor, user_id):
+        """Initialize the sensor."""
+        self.sensor = sensor
+        self.user_id = user_id
 
-def load_authentications(authfile, exclude, exclude_clients):
-    """Load info from auth file."""
+    @property
+    def name(self):
+        """Return the name of the sensor."""
+        return f"Authenticated {self.sensor.auth.users.get(self.user_id, self.user_id)}"
+
+    @property
+    def state(self):
+        """Return the number of IP addresses the user logged in from."""
+        return len(self.sensor.index.by_user.get(self.user_id, ()))
+
+    @property
+    def icon(self):
+        """Return the icon of the sensor."""
+        return "mdi:account-lock"
+
+    @property
+    def extra_state_attributes(self):
+        """Return the most recent login and the countries of the user."""
+        addresses = self.sensor.index.by_user.get(self.user_id)
+        if not addresses:
+            return None
+        known = self.hass.data[PLATFORM_NAME]
+        last_ip = known[max(addresses, key=lambda ipaddr: known[ipaddr].last_used_ts)]
+        return {
+            ATTR_IP_ADDRESS: last_ip.ip_address,
+            ATTR_LAST_AUTHENTICATE_TIME: last_ip.last_used_at,
+            ATTR_COUNTRY: last_ip.country,
+            ATTR_COUNTRIES: sorted(
+                {known[ipaddr].country for ipaddr in addresses} - {None}
+            ),
+        }
+
+
+class AuthFile:
+    """Auth store that is only parsed again when it changes on disk."""
+
+    def __init__(self, path, exclusions):
+        """Initialize."""
+        self.path = path
+        self.exclusions = exclusions
+        self.signature = None
+        self.users = {}
+        self.system_users = set()
+        self.tokens = {}
+        self.changed = {}
+
+    async def async_load(self, hass):
+        """Load the auth store, return True if its content has changed."""
+        loaded = await hass.async_add_executor_job(self.read)
+        if loaded is None:
+            return False
+        self.signature, users, self.system_users, self.tokens, self.changed = loaded
+        # Swapped in on the event loop, IPData objects keep a reference.
+        self.users.clear()
+        self.users.update(users)
+        return True
+
+    def read(self):
+        """Parse the auth store in the executor, return None if unchanged.
+
+        Return the signature, users, system generated users, tokens and
+        changed tokens without touching the state the event loop reads.
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            signature = None
+        else:
+            signature = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+        if signature is not None and signature == self.signature:
+            return None
+
+        system_users = set()
+        with METRICS.timer("load_authentications"):
+            loaded = load_authentications(self.path, self.exclusions, system_users)
+        if not loaded:
+            return None
+
+        users, tokens = loaded
+        changed = {
+            ipaddr: token
+            for ipaddr, token in tokens.items()
+            if self.tokens.get(ipaddr) != token
+        }
+        return signature, users, system_users, tokens, changed
+
+
+def load_authentications(authfile, exclusions, system_users=None):
+    """Load info from auth file.
+
+    The ids of system generated users are added to system_users, if given.
+    """
     if not os.path.exists(authfile):
         _LOGGER.critical("File is missing %s", authfile)
         return False
-    with open(authfile) as authfile:
-        auth = json.loads(authfile.read())
-
     users = {}
-    for user in auth["data"]["users"]:
-        users[user["id"]] = user["name"]
-
-    tokens = auth["data"]["refresh_tokens"]
     tokens_cleaned = {}
 
-    for token in tokens:
+    # Stream the store, only one user or refresh token is decoded at a time.
+    for section, token in iter_auth_store(authfile):
+        if section == "users":
+            users[token["id"]] = token["name"]
+            if system_users is not None and token.get("system_generated"):
+                system_users.add(token["id"])
+            continue
         try:
-            for excludeaddress in exclude:
-                if ValidateIP(token["last_used_ip"]) in ip_network(
-                    excludeaddress, False
-                ):
-                    raise Exception("IP in excluded address configuration")
-            if token["client_id"] in exclude_clients:
-                raise Exception("Client in excluded clients configuration")
+            if exclusions.excluded(token):
+                continue
             if token.get("last_used_at") is None:
                 continue
             if token["last_used_ip"] in tokens_cleaned:
@@ -405,6 +1229,23 @@ def load_authentications(authfile, exclude, exclude_clients):
 class AuthenticatedData:
     """Data class for authenticated values."""
 
+    __slots__ = (
+        "ipaddr",
+        "attributes",
+        "last_access",
+        "prev_access",
+        "country",
+        "region",
+        "city",
+        "asn",
+        "org",
+        "latitude",
+        "longitude",
+        "user_id",
+        "hostname",
+        "history",
+    )
+
     def __init__(self, ipaddr, attributes):
         """Initialize."""
         self.ipaddr = ipaddr
@@ -416,13 +1257,82 @@ class AuthenticatedData:
         self.city = attributes.get("city")
         self.asn = attributes.get("asn")
         self.org = attributes.get("org")
+        self.latitude = coordinate(attributes.get("latitude"))
+        self.longitude = coordinate(attributes.get("longitude"))
         self.user_id = attributes.get("user_id")
         self.hostname = attributes.get("hostname")
+        self.history = attributes.get("history")
+
+    def update_from(self, store):
+        """Use the values known from the store where it has them."""
+        if store.user_id is not None:
+            self.user_id = store.user_id
+
+        if store.hostname is not None:
+            self.hostname = store.hostname
+
+        if store.country is not None:
+            self.country = store.country
+
+        if store.region is not None:
+            self.region = store.region
+
+        if store.city is not None:
+            self.city = store.city
+
+        if store.asn is not None:
+            self.asn = store.asn
+
+        if store.org is not None:
+            self.org = store.org
+
+        if store.latitude is not None:
+            self.latitude = store.latitude
+            self.longitude = store.longitude
+
+        if store.history is not None:
+            self.history = store.history
+
+        if store.last_access is not None:
+            self.last_access = store.last_access
+        elif store.attributes.get("last_authenticated") is not None:
+            self.last_access = store.attributes["last_authenticated"]
+        elif store.attributes.get("last_used_at") is not None:
+            self.last_access = store.attributes["last_used_at"]
+
+        if store.prev_access is not None:
+            self.prev_access = store.prev_access
+        elif store.attributes.get("previous_authenticated_time") is not None:
+            self.prev_access = store.attributes["previous_authenticated_time"]
+        elif store.attributes.get("prev_used_at") is not None:
+            self.prev_access = store.attributes["prev_used_at"]
 
 
 class IPData:
     """IP Address class."""
 
+    __slots__ = (
+        "all_users",
+        "provider",
+        "ip_address",
+        "_last_used_at",
+        "last_used_ts",
+        "prev_used_at",
+        "user_id",
+        "hostname",
+        "city",
+        "region",
+        "country",
+        "asn",
+        "org",
+        "latitude",
+        "longitude",
+        "score",
+        "travel_speed",
+        "new_ip",
+        "history",
+    )
+
     def __init__(self, access_data, users, provider, new=True):
         """Initialize."""
         self.all_users = users
@@ -437,7 +1347,23 @@ class IPData:
         self.country = access_data.country
         self.asn = access_data.asn
         self.org = access_data.org
+        self.latitude = access_data.latitude
+        self.longitude = access_data.longitude
+        self.score = None
+        self.travel_speed = None
         self.new_ip = new
+        self.history = LoginHistory(access_data.history)
+
+    @property
+    def last_used_at(self):
+        """Return the time of the last login, as stored."""
+        return self._last_used_at
+
+    @last_used_at.setter
+    def last_used_at(self, value):
+        """Set the time of the last login and its parsed timestamp."""
+        self._last_used_at = value
+        self.last_used_ts = timestamp(value) if value is not None else 0
 
     @property
     def username(self):
@@ -448,18 +1374,45 @@ class IPData:
             return self.all_users[self.user_id]
         return "Unknown"
 
-    def lookup(self):
-        """Look up data for the IP address."""
-        geo = get_geo_data(self.ip_address, self.provider)
+    def add_login(self, user_id=None):
+        """Record the latest login in the history."""
+        if self.last_used_ts:
+            self.history.add(self.last_used_ts, user_id or self.user_id)
+
+    @property
+    def geo(self):
+        """Return the geo data as a lookup result."""
+        return {
+            "country": self.country,
+            "region": self.region,
+            "city": self.city,
+            "asn": self.asn,
+            "org": self.org,
+            "latitude": self.latitude,
+            "longitude": self.longitude,
+        }
+
+    @property
+    def needs_geo(self):
+        """Return True for a public address without any geo data."""
+        return (
+            all(value is None for value in self.geo.values())
+            and ValidateIP(self.ip_address).is_global
+        )
+
+    def update_geo(self, geo):
+        """Set the geo data from a lookup result."""
         if geo["result"]:
             self.country = geo.get("data", {}).get("country")
             self.region = geo.get("data", {}).get("region")
             self.city = geo.get("data", {}).get("city")
             self.asn = geo.get("data", {}).get("asn")
             self.org = geo.get("data", {}).get("org")
+            self.latitude = geo.get("data", {}).get("latitude")
+            self.longitude = geo.get("data", {}).get("longitude")
 
-    def notify(self, hass):
-        """Create persistant notification."""
+    def notification_message(self):
+        """Return the text of the notification for this login."""
         message = f"""
         **IP Address:**   {self.ip_address}
         **Username:**    {self.username}
@@ -472,6 +1425,7 @@ class IPData:
             (self.city, "City"),
             (self.asn, "ASN"),
             (self.org, "Organisation"),
+            (self.score, "Anomaly score"),
         ]:
             if notify_val is not None:
                 message += f"**{notify_str}:**  {notify_val}\n"
@@ -479,6 +1433,4 @@ class IPData:
         if self.last_used_at is not None:
             message += f"**Login time:**   {self.last_used_at[:19].replace('T', ' ')}"
 
-        async_create(
-            hass, message, title="New successful login", notification_id=self.ip_address
-        )
+        return message
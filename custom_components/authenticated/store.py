@@ -0,0 +1,312 @@
+"""Storage backends for known IP addresses."""
+
+import asyncio
+import logging
+import os
+import sqlite3
+import tempfile
+from contextlib import closing, suppress
+
+import yaml
+from homeassistant.const import EVENT_HOMEASSISTANT_FINAL_WRITE
+from homeassistant.core import callback
+from homeassistant.helpers.event import async_call_later
+
+from .metrics import METRICS
+
+_LOGGER = logging.getLogger(__name__)
+
+FIELDS = (
+    "user_id",
+    "username",
+    "last_used_at",
+    "prev_used_at",
+    "country",
+    "hostname",
+    "region",
+    "city",
+    "asn",
+    "org",
+    "latitude",
+    "longitude",
+)
+
+SCHEMA_VERSION = 3
+
+
+def get_outfile_content(file):
+    """Get the content of the outfile."""
+    with open(file) as out_file:
+        content = yaml.load(out_file, Loader=yaml.FullLoader)
+    out_file.close()
+
+    if isinstance(content, dict):
+        return content
+    return {}
+
+
+class YamlStore:
+    """Known IP addresses kept in the YAML outfile."""
+
+    def __init__(self, path):
+        """Initialize."""
+        self.path = path
+
+    def load(self):
+        """Return all stored records by IP address."""
+        if not os.path.isfile(self.path):
+            _LOGGER.debug("File has not been created, no data pressent.")
+            return {}
+        return get_outfile_content(self.path)
+
+    def save(self, records):
+        """Merge changed records into the outfile, None removes a record."""
+        info = self.load()
+        for ipaddr, record in records.items():
+            if record is None:
+                info.pop(ipaddr, None)
+            else:
+                info[ipaddr] = record
+        write_atomic(
+            self.path,
+            yaml.dump(info, default_flow_style=False, explicit_start=True),
+        )
+
+
+class SqliteStore:
+    """Known IP addresses kept in SQLite, one row per address.
+
+    Only changed records are written. On first use the existing YAML
+    outfile is imported, if there is one.
+    """
+
+    def __init__(self, path, legacy_path=None):
+        """Initialize."""
+        self.path = path
+        self.legacy_path = legacy_path
+
+    def connect(self):
+        """Open the database, creating and migrating it when needed."""
+        connection = sqlite3.connect(self.path)
+        connection.row_factory = sqlite3.Row
+        if connection.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            with connection:
+                self.create(connection)
+                self.add_columns(connection)
+                self.migrate(connection)
+                connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        return connection
+
+    @staticmethod
+    def create(connection):
+        """Create the tables and indexes."""
+        columns = ", ".join(f"{field} TEXT" for field in FIELDS)
+        connection.execute(
+            f"CREATE TABLE IF NOT EXISTS ip_addresses (ip TEXT PRIMARY KEY, {columns})"
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS ip_addresses_user_id ON ip_addresses (user_id)"
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS ip_addresses_last_used_at "
+            "ON ip_addresses (last_used_at)"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS logins "
+            "(ip TEXT NOT NULL, timestamp INTEGER NOT NULL, user_id TEXT, "
+            "PRIMARY KEY (ip, timestamp))"
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS logins_user_id ON logins (user_id, timestamp)"
+        )
+
+    @staticmethod
+    def add_columns(connection):
+        """Add the columns of fields that are newer than the table."""
+        existing = {
+            row["name"] for row in connection.execute("PRAGMA table_info(ip_addresses)")
+        }
+        for field in FIELDS:
+            if field not in existing:
+                connection.execute(f"ALTER TABLE ip_addresses ADD COLUMN {field} TEXT")
+
+    def migrate(self, connection):
+        """Import the YAML outfile."""
+        if connection.execute("SELECT 1 FROM ip_addresses LIMIT 1").fetchone():
+            # Upgrading an existing database.
+            return
+        if self.legacy_path is None or not os.path.isfile(self.legacy_path):
+            return
+        records = {}
+        for ipaddr, stored in get_outfile_content(self.legacy_path).items():
+            if not isinstance(stored, dict):
+                continue
+            record = {field: stored.get(field) for field in FIELDS}
+            record["last_used_at"] = stored.get("last_used_at") or stored.get(
+                "last_authenticated"
+            )
+            record["prev_used_at"] = stored.get("prev_used_at") or stored.get(
+                "previous_authenticated_time"
+            )
+            record["history"] = stored.get("history")
+            records[str(ipaddr)] = record
+        self.upsert(connection, records)
+        _LOGGER.info("Imported %s records from %s", len(records), self.legacy_path)
+
+    @staticmethod
+    def upsert(connection, records):
+        """Insert or update records and add new logins to their history."""
+        columns = ", ".join(FIELDS)
+        placeholders = ", ".join("?" for _ in FIELDS)
+        updates = ", ".join(f"{field} = excluded.{field}" for field in FIELDS)
+        connection.executemany(
+            f"INSERT INTO ip_addresses (ip, {columns}) VALUES (?, {placeholders}) "
+            f"ON CONFLICT (ip) DO UPDATE SET {updates}",
+            (
+                (ipaddr, *(_text(record.get(field)) for field in FIELDS))
+                for ipaddr, record in records.items()
+            ),
+        )
+        for ipaddr, record in records.items():
+            history = record.get("history")
+            if not history:
+                continue
+            connection.executemany(
+                "INSERT OR IGNORE INTO logins (ip, timestamp, user_id) VALUES (?, ?, ?)",
+                ((ipaddr, when, user_id) for when, user_id in history),
+            )
+            # Keep the same logins as the in-memory history.
+            connection.execute(
+                "DELETE FROM logins WHERE ip = ? AND timestamp < ?",
+                (ipaddr, min(when for when, _ in history)),
+            )
+
+    def load(self):
+        """Return all stored records by IP address."""
+        with closing(self.connect()) as connection:
+            records = {
+                row["ip"]: {field: row[field] for field in FIELDS}
+                for row in connection.execute("SELECT * FROM ip_addresses")
+            }
+            for row in connection.execute(
+                "SELECT ip, timestamp, user_id FROM logins ORDER BY timestamp"
+            ):
+                if row["ip"] in records:
+                    records[row["ip"]].setdefault("history", []).append(
+                        [row["timestamp"], row["user_id"]]
+                    )
+            return records
+
+    def save(self, records):
+        """Write changed records, None removes a record."""
+        with closing(self.connect()) as connection, connection:
+            self.upsert(
+                connection,
+                {ipaddr: record for ipaddr, record in records.items() if record},
+            )
+            removed = [
+                (ipaddr,) for ipaddr, record in records.items() if record is None
+            ]
+            connection.executemany("DELETE FROM ip_addresses WHERE ip = ?", removed)
+            connection.executemany("DELETE FROM logins WHERE ip = ?", removed)
+
+
+class DelayedWriter:
+    """Collect changed records and write them to a store after a delay.
+
+    Records changed again before the delay has passed are written once,
+    with their latest content. Writes run in the executor, and anything
+    still pending is written when Home Assistant shuts down.
+    """
+
+    def __init__(self, hass, store, delay):
+        """Initialize."""
+        self.hass = hass
+        self.store = store
+        self.delay = delay
+        self.pending = {}
+        self.unsub_write = None
+        self.lock = asyncio.Lock()
+        self.unsub_final_write = hass.bus.async_listen_once(
+            EVENT_HOMEASSISTANT_FINAL_WRITE, self.async_final_write
+        )
+
+    @callback
+    def async_schedule(self, records):
+        """Queue records to be written."""
+        self.pending.update(records)
+        if self.unsub_write is None:
+            self.unsub_write = async_call_later(
+                self.hass, self.delay, self.async_delayed_write
+            )
+
+    @callback
+    def async_delayed_write(self, _now):
+        """Write pending records once the delay has passed."""
+        self.unsub_write = None
+        self.hass.async_create_task(self.async_flush())
+
+    async def async_flush(self):
+        """Write pending records now."""
+        if self.unsub_write is not None:
+            self.unsub_write()
+            self.unsub_write = None
+        async with self.lock:
+            records, self.pending = self.pending, {}
+            if not records:
+                return
+            try:
+                with METRICS.timer("write_to_file"):
+                    await self.hass.async_add_executor_job(self.store.save, records)
+            except (OSError, sqlite3.Error, yaml.YAMLError) as exception:
+                METRICS.count("write_error")
+                _LOGGER.error("Unable to write %s records: %s", len(records), exception)
+                self.pending = {**records, **self.pending}
+            else:
+                METRICS.count("records_written", len(records))
+
+    async def async_final_write(self, _event):
+        """Write pending records on shutdown."""
+        self.unsub_final_write = None
+        await self.async_flush()
+
+    async def async_close(self):
+        """Write pending records and stop listening for shutdown."""
+        if self.unsub_final_write is not None:
+            self.unsub_final_write()
+            self.unsub_final_write = None
+        await self.async_flush()
+
+
+def write_atomic(path, content):
+    """Replace a file through a synced temporary file and a rename."""
+    directory, filename = os.path.split(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{filename}.", dir=directory)
+    try:
+        # mkstemp creates the file readable by its owner only.
+        try:
+            mode = os.stat(path).st_mode & 0o777
+        except FileNotFoundError:
+            mode = 0o666 & ~_umask()
+        os.chmod(tmp_path, mode)
+        with open(fd, "w") as tmp_file:
+            tmp_file.write(content)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        with suppress(OSError):
+            os.unlink(tmp_path)
+        raise
+
+
+def _umask():
+    """Return the umask of the process."""
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def _text(value):
+    """Return a value as stored in a TEXT column."""
+    return None if value is None else str(value)
@@ -0,0 +1,106 @@
+"""Watch files for changes using inotify."""
+
+import ctypes
+import logging
+import os
+import struct
+
+_LOGGER = logging.getLogger(__name__)
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+EVENT = struct.Struct("iIII")
+
+
+def _load_libc():
+    """Return libc if it provides inotify, otherwise None."""
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.inotify_init1  # noqa: B018
+        libc.inotify_add_watch  # noqa: B018
+    except (AttributeError, OSError):
+        return None
+    return libc
+
+
+class FileWatcher:
+    """Call a callback on the event loop when a file has been written.
+
+    The parent directory is watched rather than the file itself, because
+    Home Assistant replaces its storage files with a rename.
+    """
+
+    def __init__(self, loop, path, callback):
+        """Initialize."""
+        self.loop = loop
+        self.directory, self.filename = os.path.split(path)
+        self.callback = callback
+        self.fd = None
+
+    def start(self):
+        """Start watching, return False if inotify is not available."""
+        libc = _load_libc()
+        if libc is None:
+            _LOGGER.debug("inotify is not available, relying on polling")
+            return False
+
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            _LOGGER.debug("inotify_init1 failed: %s", os.strerror(ctypes.get_errno()))
+            return False
+
+        if (
+            libc.inotify_add_watch(
+                fd, os.fsencode(self.directory), IN_CLOSE_WRITE | IN_MOVED_TO
+            )
+            < 0
+        ):
+            _LOGGER.debug(
+                "Unable to watch %s: %s",
+                self.directory,
+                os.strerror(ctypes.get_errno()),
+            )
+            os.close(fd)
+            return False
+
+        self.fd = fd
+        self.loop.add_reader(fd, self._read_events)
+        _LOGGER.debug(
+            "Watching %s for changes", os.path.join(self.directory, self.filename)
+        )
+        return True
+
+    def stop(self):
+        """Stop watching."""
+        if self.fd is None:
+            return
+        self.loop.remove_reader(self.fd)
+        os.close(self.fd)
+        self.fd = None
+
+    def _read_events(self):
+        """Read pending events and call back if the watched file changed."""
+        try:
+            buffer = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        except OSError as exception:
+            _LOGGER.debug("Error reading inotify events: %s", exception)
+            return
+
+        changed = False
+        offset = 0
+        while offset + EVENT.size <= len(buffer):
+            _, mask, _, length = EVENT.unpack_from(buffer, offset)
+            offset += EVENT.size
+            name = buffer[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW or os.fsdecode(name) == self.filename:
+                changed = True
+
+        if changed:
+            self.callback()
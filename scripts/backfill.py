@@ -0,0 +1,360 @@
+"""Look up geo data for unknown IP addresses before Home Assistant starts.
+
+Reads a copy of .storage/auth and the existing outfile, looks up every
+IP address of a refresh token that the outfile does not know yet, and
+writes the results to the outfile (or the SQLite store), in the format
+the sensor reads at startup. Home Assistant then has nothing left to look
+up and the sensor is ready right away, however large the auth store.
+
+Addresses are looked up in chunks by a bounded pool of workers, with the
+provider chain, retries and circuit breakers the sensor uses. While
+every provider is paused by a rate limit, the workers wait for the first
+one to come back. Addresses no provider answers for are not stored, so
+the sensor looks them up itself. Finished chunks are appended to a
+checkpoint file, so an interrupted run continues where it stopped when
+started again.
+
+Run it from the repository root with the requirements installed, while
+Home Assistant is stopped:
+
+    python3 scripts/backfill.py --config /config --provider ipinfo ipapi
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from ipaddress import ip_address
+
+import aiohttp
+
+sys.path.insert(
+    0,
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "custom_components"),
+)
+
+# pylint: disable=wrong-import-position
+from authenticated import sensor  # noqa: E402
+from authenticated.const import OUTFILE, OUTFILE_DB  # noqa: E402
+from authenticated.exclude import ExclusionMatcher  # noqa: E402
+from authenticated.metrics import METRICS  # noqa: E402
+from authenticated.providers import (  # noqa: E402
+    PROVIDERS,
+    LocalDatabase,
+    warn_insecure,
+)
+from authenticated.resolver import HostnameResolver  # noqa: E402
+from authenticated.store import FIELDS, SqliteStore, YamlStore  # noqa: E402
+
+_LOGGER = logging.getLogger("backfill")
+
+CHECKPOINT_SUFFIX = ".backfill"
+MAX_ATTEMPTS = 3
+
+
+class Checkpoint:
+    """Records of finished addresses, appended one JSON line at a time."""
+
+    def __init__(self, path):
+        """Initialize."""
+        self.path = path
+        self.records = {}
+        self.file = None
+
+    def load(self):
+        """Read the records of an earlier run, return how many there are."""
+        if not os.path.isfile(self.path):
+            return 0
+        with open(self.path) as checkpoint:
+            for line in checkpoint:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # The last line of an interrupted run may be cut off.
+                    continue
+                self.records[entry["ip"]] = entry["record"]
+        return len(self.records)
+
+    def add(self, records):
+        """Append finished records and flush them to disk."""
+        if self.file is None:
+            self.file = open(self.path, "a")
+        for ipaddr, record in records.items():
+            self.file.write(json.dumps({"ip": ipaddr, "record": record}) + "\n")
+            self.records[ipaddr] = record
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        """Close the checkpoint file."""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class Backfill:
+    """Look up unknown addresses with a pool of workers."""
+
+    def __init__(self, args, users, tokens, checkpoint):
+        """Initialize."""
+        self.args = args
+        self.users = users
+        self.tokens = tokens
+        self.checkpoint = checkpoint
+        self.resolver = (
+            HostnameResolver(args.dns_timeout) if args.resolve_hostnames else None
+        )
+        self.queue = asyncio.Queue()
+        self.attempts = {}
+        self.total = 0
+        self.skipped = 0
+
+    def paused_for(self):
+        """Return the seconds until a provider takes requests again."""
+        now = time.monotonic()
+        return min(
+            max(PROVIDERS[name].circuit_breaker().open_until - now, 0)
+            for name in self.args.provider
+        )
+
+    def record(self, ipaddr, result):
+        """Return the stored record of an address and its lookup result."""
+        ipaddress = sensor.IPData(
+            sensor.AuthenticatedData(ipaddr, self.tokens[ipaddr]),
+            self.users,
+            self.args.provider,
+            False,
+        )
+        ipaddress.add_login()
+        ipaddress.update_geo(result)
+        return ipaddress
+
+    async def async_run(self, pending):
+        """Look up all pending addresses."""
+        self.total = len(pending) + len(self.checkpoint.records)
+        for start in range(0, len(pending), self.args.chunk_size):
+            self.queue.put_nowait(pending[start : start + self.args.chunk_size])
+        async with aiohttp.ClientSession() as session:
+            workers = [
+                asyncio.create_task(self.async_worker(session))
+                for _ in range(self.args.workers)
+            ]
+            try:
+                await self.queue.join()
+            finally:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+
+    async def async_worker(self, session):
+        """Take chunks from the queue until the run is cancelled."""
+        while True:
+            chunk = await self.queue.get()
+            try:
+                await self.async_process(session, chunk)
+            except Exception:  # Keep the pool running, the chunk is retried.
+                _LOGGER.exception("Lookup of %s addresses failed", len(chunk))
+                self.give_up(self.retry(chunk))
+            finally:
+                self.queue.task_done()
+            if self.args.pause:
+                await asyncio.sleep(self.args.pause)
+
+    async def async_process(self, session, chunk):
+        """Look up one chunk and add the finished addresses to the checkpoint."""
+        if (paused := self.paused_for()) > 0:
+            _LOGGER.info("All providers are paused, waiting %.1f seconds", paused)
+            await asyncio.sleep(paused)
+        results = await sensor.async_get_geo_data_many(
+            session, chunk, self.args.provider
+        )
+
+        # Addresses without an answer are not stored, so the sensor looks
+        # them up itself. While every provider is paused they were probably
+        # skipped for a rate limit, those are tried again first.
+        unanswered = {
+            ipaddr
+            for ipaddr in chunk
+            if not results[ipaddr]["result"] and ip_address(ipaddr).is_global
+        }
+        if unanswered and self.paused_for() > 0:
+            self.give_up(self.retry(unanswered))
+        else:
+            self.give_up(unanswered)
+        done = [ipaddr for ipaddr in chunk if ipaddr not in unanswered]
+        addresses = [self.record(ipaddr, results[ipaddr]) for ipaddr in done]
+
+        if self.resolver is not None:
+            hostnames = await self.resolver.async_resolve_many(done)
+            for ipaddress in addresses:
+                ipaddress.hostname = hostnames[ipaddress.ip_address]
+
+        records = {}
+        for ipaddress in addresses:
+            records[ipaddress.ip_address] = {
+                field: getattr(ipaddress, field) for field in FIELDS
+            }
+            records[ipaddress.ip_address]["history"] = ipaddress.history.as_list()
+        self.checkpoint.add(records)
+        _LOGGER.info(
+            "%s of %s addresses stored, %s left for the sensor",
+            len(self.checkpoint.records),
+            self.total,
+            self.skipped,
+        )
+
+    def retry(self, ipaddrs):
+        """Queue addresses again, return those that were tried too often."""
+        retry, given_up = [], []
+        for ipaddr in ipaddrs:
+            self.attempts[ipaddr] = self.attempts.get(ipaddr, 0) + 1
+            if self.attempts[ipaddr] < MAX_ATTEMPTS:
+                retry.append(ipaddr)
+            else:
+                given_up.append(ipaddr)
+        if retry:
+            self.queue.put_nowait(retry)
+        return given_up
+
+    def give_up(self, ipaddrs):
+        """Leave addresses out of the store, for the sensor to look up."""
+        if ipaddrs:
+            self.skipped += len(ipaddrs)
+            _LOGGER.warning(
+                "No geo data for %s addresses, the sensor will look them up",
+                len(ipaddrs),
+            )
+
+
+def pending_addresses(tokens, stored, checkpoint):
+    """Return the addresses of refresh tokens that still need a lookup."""
+    pending = []
+    for ipaddr in tokens:
+        try:
+            ip_address(ipaddr)
+        except ValueError:
+            continue
+        if ipaddr not in stored and ipaddr not in checkpoint.records:
+            pending.append(ipaddr)
+    return pending
+
+
+def parse_args():
+    """Parse the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument(
+        "--config", default=".", help="Home Assistant configuration directory"
+    )
+    parser.add_argument("--auth", help="auth store, default <config>/.storage/auth")
+    parser.add_argument("--outfile", help=f"outfile, default <config>/{OUTFILE}")
+    parser.add_argument("--storage", choices=("yaml", "sqlite"), default="yaml")
+    parser.add_argument(
+        "--database", help=f"SQLite store, default <config>/{OUTFILE_DB}"
+    )
+    parser.add_argument(
+        "--provider",
+        nargs="+",
+        choices=sorted(PROVIDERS),
+        default=["ipinfo"],
+        help="providers to try in order",
+    )
+    parser.add_argument(
+        "--local-database", help="CSV range database for the local provider"
+    )
+    parser.add_argument("--exclude", nargs="*", default=[], help="excluded networks")
+    parser.add_argument(
+        "--exclude-clients", nargs="*", default=[], help="excluded client IDs"
+    )
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument(
+        "--chunk-size", type=int, default=100, help="addresses per worker task"
+    )
+    parser.add_argument(
+        "--pause", type=float, default=0.0, help="seconds between chunks per worker"
+    )
+    parser.add_argument("--resolve-hostnames", action="store_true")
+    parser.add_argument("--dns-timeout", type=int, default=3)
+    parser.add_argument(
+        "--checkpoint", help=f"checkpoint file, default <outfile>{CHECKPOINT_SUFFIX}"
+    )
+    parser.add_argument(
+        "--keep-checkpoint",
+        action="store_true",
+        help="keep the checkpoint file after the store was written",
+    )
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    args.auth = args.auth or os.path.join(args.config, ".storage", "auth")
+    args.outfile = args.outfile or os.path.join(args.config, OUTFILE)
+    args.database = args.database or os.path.join(args.config, OUTFILE_DB)
+    args.checkpoint = args.checkpoint or args.outfile + CHECKPOINT_SUFFIX
+    return args
+
+
+async def async_main(args):
+    """Run the backfill, return the exit status."""
+    loaded = sensor.load_authentications(
+        args.auth, ExclusionMatcher(args.exclude, args.exclude_clients)
+    )
+    if not loaded:
+        return 1
+    users, tokens = loaded
+
+    if args.storage == "sqlite":
+        store = SqliteStore(args.database, args.outfile)
+    else:
+        store = YamlStore(args.outfile)
+    stored = {str(ipaddr) for ipaddr in store.load()}
+
+    checkpoint = Checkpoint(args.checkpoint)
+    if resumed := checkpoint.load():
+        _LOGGER.info("Continuing with %s addresses from %s", resumed, args.checkpoint)
+    pending = pending_addresses(tokens, stored, checkpoint)
+    _LOGGER.info(
+        "%s addresses in the auth store, %s to look up", len(tokens), len(pending)
+    )
+
+    backfill = Backfill(args, users, tokens, checkpoint)
+    try:
+        if pending:
+            await backfill.async_run(pending)
+    finally:
+        checkpoint.close()
+    if backfill.skipped:
+        _LOGGER.warning(
+            "%s addresses got no geo data and were not stored, the sensor looks "
+            "them up at startup, or run the backfill again",
+            backfill.skipped,
+        )
+
+    if checkpoint.records:
+        store.save(checkpoint.records)
+        _LOGGER.info("Wrote %s addresses to the store", len(checkpoint.records))
+    if not args.keep_checkpoint and os.path.isfile(args.checkpoint):
+        os.remove(args.checkpoint)
+    _LOGGER.info("Provider counters: %s", dict(METRICS.counters))
+    return 0
+
+
+def main():
+    """Run the backfill."""
+    args = parse_args()
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)s %(levelname)s %(message)s",
+    )
+    if args.local_database:
+        LocalDatabase.set_database(args.local_database)
+    elif LocalDatabase.name in args.provider:
+        _LOGGER.critical("The local provider needs --local-database")
+        return 1
+    warn_insecure(args.provider)
+    METRICS.enabled = True
+    return asyncio.run(async_main(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,525 @@
+"""Benchmark the authenticated sensor against synthetic auth stores.
+
+Each run creates a temporary config directory with a generated
+.storage/auth file and a prefilled outfile, starts a local HTTP server
+that answers like the selected geo provider (including rate-limit and
+error replies), and measures the phases the sensor goes through:
+
+    load_authentications  parse the auth store once
+    initial_run           platform setup, until the sensor can be added
+    enrich                background lookups for unknown addresses
+    write_initial         write everything the initial run changed
+    update                poll after a share of the tokens logged in again
+    write_update          write the records changed by that poll
+    update_idle           poll with an unchanged auth store
+
+For every phase it reports wall time, peak traced memory and the
+requests the stub server received. Reverse DNS is answered locally as
+well, so runs do not depend on the network.
+
+Run it from the repository root with the requirements installed:
+
+    python3 scripts/benchmark.py --tokens 1000 10000 100000
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from datetime import UTC, datetime, timedelta
+from ipaddress import IPv4Address, IPv6Address
+
+from aiohttp import web
+
+sys.path.insert(
+    0,
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "custom_components"),
+)
+
+# pylint: disable=wrong-import-position
+from authenticated import sensor  # noqa: E402
+from authenticated.exclude import ExclusionMatcher  # noqa: E402
+from authenticated.providers import PROVIDERS  # noqa: E402
+from authenticated.resolver import HostnameResolver  # noqa: E402
+from authenticated.store import SqliteStore, YamlStore  # noqa: E402
+from homeassistant.core import HomeAssistant  # noqa: E402
+
+STUB_PROVIDERS = ("ipapi", "ipinfo", "ip-api")
+COUNTRIES = ("Norway", "Sweden", "Germany", "Netherlands", "United States")
+# Capital of each country, so consecutive logins give real travel speeds.
+LOCATIONS = (
+    (59.91, 10.75),
+    (59.33, 18.07),
+    (52.52, 13.40),
+    (52.37, 4.90),
+    (38.9, -77.04),
+)
+
+
+class StubGeoServer:
+    """Local HTTP server answering like the public geo providers."""
+
+    def __init__(self, rate_limit_every, error_rate, latency, seed):
+        """Initialize."""
+        self.rate_limit_every = rate_limit_every
+        self.error_rate = error_rate
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.requests = Counter()
+        self.runner = None
+        self.port = None
+
+    async def async_start(self):
+        """Start listening on a free local port."""
+        app = web.Application()
+        app.router.add_get("/ipapi/{ip}/json", self.handle_ipapi)
+        app.router.add_get("/ipinfo/{ip}/json", self.handle_ipinfo)
+        app.router.add_get("/ip-api/json/{ip}", self.handle_ipapicom)
+        app.router.add_post("/ip-api/batch", self.handle_ipapicom_batch)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        self.port = sock.getsockname()[1]
+        await web.SockSite(self.runner, sock).start()
+
+    async def async_stop(self):
+        """Stop the server."""
+        await self.runner.cleanup()
+
+    def use_for(self, provider):
+        """Point a provider at this server."""
+        base = f"http://127.0.0.1:{self.port}/{provider}"
+        cls = PROVIDERS[provider]
+        if provider == "ip-api":
+            cls.url = f"{base}/json/{{}}?fields={cls.fields}"
+            cls.batch_url = f"{base}/batch?fields={cls.fields}"
+        else:
+            cls.url = f"{base}/{{}}/json"
+
+    async def async_outcome(self):
+        """Count a request and decide how to answer it."""
+        self.requests["total"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if (
+            self.rate_limit_every
+            and self.requests["total"] % self.rate_limit_every == 0
+        ):
+            self.requests["rate_limited"] += 1
+            return "rate_limited"
+        if self.random.random() < self.error_rate:
+            self.requests["error"] += 1
+            return "error"
+        self.requests["ok"] += 1
+        return "ok"
+
+    @staticmethod
+    def error_response():
+        """Return a server error that is not JSON."""
+        return web.Response(status=502, text="<html>Bad Gateway</html>")
+
+    @staticmethod
+    def geo(ipaddr):
+        """Return stable fake geo data for an address."""
+        value = sum(ipaddr.encode())
+        latitude, longitude = LOCATIONS[value % len(COUNTRIES)]
+        return {
+            "country": COUNTRIES[value % len(COUNTRIES)],
+            "region": f"Region {value % 17}",
+            "city": f"City {value % 101}",
+            "asn": f"AS{64512 + value % 1000}",
+            "org": f"Example Networks {value % 50}",
+            "latitude": round(latitude + value % 101 / 100, 4),
+            "longitude": round(longitude + value % 101 / 100, 4),
+        }
+
+    async def handle_ipapi(self, request):
+        """Answer like ipapi.co."""
+        outcome = await self.async_outcome()
+        ipaddr = request.match_info["ip"]
+        if outcome == "rate_limited":
+            return web.json_response(
+                {"error": True, "reason": "RateLimited", "message": "Rate limited"},
+                status=429,
+            )
+        if outcome == "error":
+            return self.error_response()
+        geo = self.geo(ipaddr)
+        return web.json_response(
+            {
+                "ip": ipaddr,
+                "country_name": geo["country"],
+                "region": geo["region"],
+                "city": geo["city"],
+                "asn": geo["asn"],
+                "org": geo["org"],
+                "latitude": geo["latitude"],
+                "longitude": geo["longitude"],
+            }
+        )
+
+    async def handle_ipinfo(self, request):
+        """Answer like ipinfo.io."""
+        outcome = await self.async_outcome()
+        ipaddr = request.match_info["ip"]
+        if outcome == "rate_limited":
+            return web.json_response(
+                {"status": 429, "error": {"title": "Rate limit exceeded"}},
+                status=429,
+            )
+        if outcome == "error":
+            return self.error_response()
+        geo = self.geo(ipaddr)
+        return web.json_response(
+            {
+                "ip": ipaddr,
+                "country": geo["country"],
+                "region": geo["region"],
+                "city": geo["city"],
+                "org": f"{geo['asn']} {geo['org']}",
+                "loc": f"{geo['latitude']},{geo['longitude']}",
+            }
+        )
+
+    def ipapicom_item(self, ipaddr):
+        """Return one ip-api.com result."""
+        geo = self.geo(ipaddr)
+        return {
+            "status": "success",
+            "country": geo["country"],
+            "regionName": geo["region"],
+            "city": geo["city"],
+            "lat": geo["latitude"],
+            "lon": geo["longitude"],
+            "as": f"{geo['asn']} {geo['org']}",
+            "org": geo["org"],
+            "query": ipaddr,
+        }
+
+    async def handle_ipapicom(self, request):
+        """Answer like ip-api.com."""
+        outcome = await self.async_outcome()
+        if outcome == "rate_limited":
+            return web.Response(status=429, text="")
+        if outcome == "error":
+            return self.error_response()
+        return web.json_response(self.ipapicom_item(request.match_info["ip"]))
+
+    async def handle_ipapicom_batch(self, request):
+        """Answer like the ip-api.com batch endpoint."""
+        ipaddrs = await request.json()
+        outcome = await self.async_outcome()
+        self.requests["batched_addresses"] += len(ipaddrs)
+        if outcome == "rate_limited":
+            return web.Response(status=429, text="")
+        if outcome == "error":
+            return self.error_response()
+        return web.json_response([self.ipapicom_item(ipaddr) for ipaddr in ipaddrs])
+
+
+async def async_stub_query(self, ip_address):
+    """Answer PTR queries locally, about half of the addresses have one."""
+    if sum(ip_address.encode()) % 2:
+        raise OSError("No PTR record")
+    return f"host-{ip_address.replace('.', '-').replace(':', '-')}.example.net"
+
+
+class Workload:
+    """Synthetic auth store and outfile for one benchmark run."""
+
+    def __init__(self, args, tokens, seed):
+        """Initialize."""
+        self.args = args
+        self.tokens = tokens
+        self.random = random.Random(seed)
+        self.now = datetime.now(UTC).replace(microsecond=0)
+        self.users = [f"{index:032x}" for index in range(1, args.users + 1)]
+        addresses = max(1, int(tokens * args.unique_ips))
+        self.addresses = [self.address(index) for index in range(addresses)]
+        self.refresh_tokens = [self.token(index) for index in range(tokens)]
+
+    def address(self, index):
+        """Return a public address, IPv6 for a share of them."""
+        if self.random.random() < self.args.ipv6:
+            return str(IPv6Address((0x2A00 << 112) + index + 1))
+        return str(IPv4Address(0x14000000 + index + 1))
+
+    def token(self, index):
+        """Return a refresh token like Home Assistant stores it."""
+        used = self.random.random() < 0.95
+        when = self.now - timedelta(seconds=self.random.randint(3600, 90 * 86400))
+        return {
+            "id": f"{index:032x}",
+            "user_id": self.random.choice(self.users),
+            "client_id": "https://home-assistant.io/iOS",
+            "client_name": None,
+            "client_icon": None,
+            "token_type": "normal",
+            "created_at": (when - timedelta(days=30)).isoformat(),
+            "access_token_expiration": 1800.0,
+            "token": os.urandom(64).hex(),
+            "jwt_key": os.urandom(64).hex(),
+            "last_used_at": when.isoformat() if used else None,
+            "last_used_ip": self.random.choice(self.addresses) if used else None,
+            "credential_id": None,
+            "version": "2025.1.0",
+        }
+
+    def write_auth(self, config_dir):
+        """Write the auth store."""
+        content = {
+            "version": 1,
+            "minor_version": 1,
+            "key": "auth",
+            "data": {
+                "users": [
+                    {
+                        "id": user_id,
+                        "group_ids": ["system-admin"],
+                        "is_owner": False,
+                        "is_active": True,
+                        "name": f"User {number}",
+                        "system_generated": False,
+                        "local_only": False,
+                    }
+                    for number, user_id in enumerate(self.users)
+                ],
+                "groups": [],
+                "credentials": [],
+                "refresh_tokens": self.refresh_tokens,
+            },
+        }
+        path = os.path.join(config_dir, ".storage", "auth")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as auth_file:
+            json.dump(content, auth_file, indent=2)
+
+    def write_outfile(self, config_dir):
+        """Store a share of the used addresses as already known."""
+        records = {}
+        for token in self.refresh_tokens:
+            ipaddr = token["last_used_ip"]
+            if ipaddr is None or ipaddr in records:
+                continue
+            if self.random.random() >= self.args.known:
+                continue
+            geo = StubGeoServer.geo(ipaddr)
+            records[ipaddr] = {
+                "user_id": token["user_id"],
+                "username": "User",
+                "last_used_at": token["last_used_at"],
+                "prev_used_at": None,
+                "hostname": None,
+                **geo,
+                "history": [],
+            }
+        if self.args.storage == "sqlite":
+            store = SqliteStore(os.path.join(config_dir, sensor.OUTFILE_DB))
+        else:
+            store = YamlStore(os.path.join(config_dir, sensor.OUTFILE))
+        store.save(records)
+
+    def churn(self):
+        """Let a share of the tokens log in again, some from new addresses."""
+        now = datetime.now(UTC).replace(microsecond=0).isoformat()
+        used = [token for token in self.refresh_tokens if token["last_used_ip"]]
+        count = min(len(used), max(1, int(len(used) * self.args.churn)))
+        for number, token in enumerate(self.random.sample(used, count)):
+            token["last_used_at"] = now
+            if self.random.random() < self.args.new_ips:
+                token["last_used_ip"] = self.address(len(self.addresses) + number)
+
+
+class Phases:
+    """Wall time, peak memory and stub requests per phase."""
+
+    def __init__(self, server, trace_memory):
+        """Initialize."""
+        self.server = server
+        self.trace_memory = trace_memory
+        self.results = []
+
+    async def async_run(self, name, action):
+        """Measure one phase."""
+        before = Counter(self.server.requests)
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        await action()
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if self.trace_memory else None
+        requests = Counter(self.server.requests)
+        requests.subtract(before)
+        self.results.append(
+            {
+                "phase": name,
+                "seconds": round(elapsed, 4),
+                "peak_mib": None if peak is None else round(peak / 2**20, 2),
+                "requests": {key: value for key, value in requests.items() if value},
+            }
+        )
+
+
+async def async_benchmark(args, server, tokens):
+    """Run all phases for one auth store size."""
+    workload = Workload(args, tokens, args.seed)
+    with tempfile.TemporaryDirectory(prefix="authenticated-bench-") as config_dir:
+        workload.write_auth(config_dir)
+        workload.write_outfile(config_dir)
+
+        hass = HomeAssistant(config_dir)
+        config = sensor.PLATFORM_SCHEMA(
+            {
+                "platform": "authenticated",
+                "provider": args.provider,
+                "storage": args.storage,
+                "watch_auth_file": False,
+                # Writes are measured as their own phases.
+                "save_delay": 24 * 60 * 60,
+            }
+        )
+        entities = []
+        authpath = os.path.join(config_dir, ".storage", "auth")
+        phases = Phases(server, not args.no_memory)
+
+        async def async_load_authentications():
+            await hass.async_add_executor_job(
+                sensor.load_authentications, authpath, ExclusionMatcher([], [])
+            )
+
+        async def async_initial_run():
+            await sensor.async_setup_platform(
+                hass, config, lambda new, update=False: entities.extend(new)
+            )
+
+        async def async_write():
+            entities[0].async_write_to_file()
+            await entities[0].writer.async_flush()
+
+        async def async_update():
+            await hass.async_add_executor_job(workload.churn)
+            await hass.async_add_executor_job(workload.write_auth, config_dir)
+            await entities[0].async_update()
+
+        await phases.async_run("load_authentications", async_load_authentications)
+        await phases.async_run("initial_run", async_initial_run)
+        await phases.async_run("enrich", entities[0].async_enrich)
+        await phases.async_run("write_initial", async_write)
+        await phases.async_run("update", async_update)
+        await phases.async_run("write_update", async_write)
+        await phases.async_run("update_idle", entities[0].async_update)
+
+        known = len(hass.data[sensor.PLATFORM_NAME])
+        scored = sum(
+            1
+            for ipaddress in hass.data[sensor.PLATFORM_NAME].values()
+            if ipaddress.travel_speed is not None
+        )
+        await entities[0].async_will_remove_from_hass()
+        await hass.async_stop(force=True)
+
+    return {
+        "tokens": tokens,
+        "known_addresses": known,
+        "with_travel_speed": scored,
+        "phases": phases.results,
+    }
+
+
+def report(results):
+    """Return the results as a text table."""
+    lines = []
+    for result in results:
+        lines.append(
+            f"\n{result['tokens']} refresh tokens, "
+            f"{result['known_addresses']} known addresses, "
+            f"{result['with_travel_speed']} with a travel speed"
+        )
+        lines.append(f"  {'phase':<22}{'seconds':>10}{'peak MiB':>10}  requests")
+        for phase in result["phases"]:
+            peak = "-" if phase["peak_mib"] is None else f"{phase['peak_mib']:.2f}"
+            requests = ", ".join(
+                f"{key}={value}" for key, value in sorted(phase["requests"].items())
+            )
+            lines.append(
+                f"  {phase['phase']:<22}{phase['seconds']:>10.3f}{peak:>10}"
+                f"  {requests or '-'}"
+            )
+    return "\n".join(lines) + "\n"
+
+
+def parse_args():
+    """Parse the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--tokens", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument(
+        "--unique-ips",
+        type=float,
+        default=0.5,
+        help="addresses per refresh token, lower values share addresses",
+    )
+    parser.add_argument("--ipv6", type=float, default=0.1, help="share of IPv6")
+    parser.add_argument(
+        "--known", type=float, default=0.9, help="share already in the outfile"
+    )
+    parser.add_argument(
+        "--churn", type=float, default=0.01, help="share of tokens used again"
+    )
+    parser.add_argument(
+        "--new-ips", type=float, default=0.2, help="share of churn from new addresses"
+    )
+    parser.add_argument("--provider", choices=STUB_PROVIDERS, default="ipapi")
+    parser.add_argument("--storage", choices=("yaml", "sqlite"), default="yaml")
+    parser.add_argument("--rate-limit-every", type=int, default=50)
+    parser.add_argument("--error-rate", type=float, default=0.02)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="stub reply delay in seconds"
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--no-memory", action="store_true", help="skip tracemalloc for clean timings"
+    )
+    parser.add_argument("--json", metavar="PATH", help="also write results as JSON")
+    return parser.parse_args()
+
+
+async def async_main(args, tokens):
+    """Run the benchmark for one auth store size."""
+    server = StubGeoServer(
+        args.rate_limit_every, args.error_rate, args.latency, args.seed
+    )
+    await server.async_start()
+    server.use_for(args.provider)
+    try:
+        return await async_benchmark(args, server, tokens)
+    finally:
+        await server.async_stop()
+
+
+def main():
+    """Run the benchmark and report the results."""
+    args = parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+    HostnameResolver.async_query = async_stub_query
+    if not args.no_memory:
+        tracemalloc.start()
+    # A fresh event loop per size, Home Assistant does not restart on one.
+    results = [asyncio.run(async_main(args, tokens)) for tokens in args.tokens]
+    sys.stdout.write(report(results))
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()